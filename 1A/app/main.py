@@ -1,10 +1,50 @@
 import fitz  # PyMuPDF
+import argparse
 import json
+import multiprocessing
+import multiprocessing.connection
 import os
 import re
-from collections import Counter
+import time
+from collections import Counter, deque
+from functools import lru_cache
 
-def detect_language(doc):
+import numpy as np
+
+import profiling
+
+try:
+    import resource  # POSIX only; used for per-file memory budgets
+except ImportError:
+    resource = None
+
+def load_page_blocks(page):
+    """Extracts a page's text dict once, in reading order when MuPDF can sort it."""
+    try:
+        # Using sort=True helps ensure correct reading order for merging
+        return page.get_text("dict", sort=True)["blocks"]
+    except Exception:
+        return page.get_text("dict")["blocks"]
+
+
+def extract_layout(doc):
+    """
+    Builds the per-document layout cache: one sorted text dict per page.
+    Language detection, the body-size histogram, number merging and heading
+    classification all read from this single copy instead of re-parsing pages.
+    """
+    return [load_page_blocks(page) for page in doc]
+
+
+def iter_spans(blocks):
+    """Yields every text span of a page's blocks."""
+    for block in blocks:
+        if block["type"] == 0:
+            for line in block.get("lines", []):
+                yield from line.get("spans", [])
+
+
+def detect_language(layout):
     """
     Detects if the document is primarily CJK or Latin-based.
     This is a simple, offline heuristic.
@@ -12,28 +52,31 @@ def detect_language(doc):
     cjk_chars = 0
     total_chars = 0
     # Sample the first few pages for efficiency
-    for page_num in range(min(len(doc), 3)):
-        text = doc[page_num].get_text("text")
-        if not text:
-            continue
-        for char in text:
-            total_chars += 1
-            # Check for CJK character ranges (Unified Ideographs, Hiragana, Katakana)
-            if '\u4e00' <= char <= '\u9fff' or \
-               '\u3040' <= char <= '\u309f' or \
-               '\u30a0' <= char <= '\u30ff':
-                cjk_chars += 1
-    
+    for blocks in layout[:3]:
+        for block in blocks:
+            if block["type"] != 0:
+                continue
+            for line in block.get("lines", []):
+                # Mirror get_text("text"): span texts followed by a line break
+                text = "".join(s["text"] for s in line.get("spans", [])) + "\n"
+                for char in text:
+                    total_chars += 1
+                    # Check for CJK character ranges (Unified Ideographs, Hiragana, Katakana)
+                    if '\u4e00' <= char <= '\u9fff' or \
+                       '\u3040' <= char <= '\u309f' or \
+                       '\u30a0' <= char <= '\u30ff':
+                        cjk_chars += 1
+
     if total_chars > 0 and (cjk_chars / total_chars) > 0.1:
         return "CJK"
     return "LATIN"
 
-def get_body_text_size(doc):
+def get_body_text_size(layout):
     """Finds the most common font size, assumed to be the body text."""
     font_counts = Counter()
-    for page in doc:
+    for blocks in layout:
         # Only sample text from blocks that look like paragraphs
-        for block in page.get_text("dict")["blocks"]:
+        for block in blocks:
             if block["type"] == 0 and len(block.get("lines", [])) > 2:
                 for line in block["lines"]:
                     for span in line["spans"]:
@@ -43,70 +86,122 @@ def get_body_text_size(doc):
     return font_counts.most_common(1)[0][0]
 
 
-def is_potential_heading(block, body_text_size):
-    """Determines if a block is a potential heading using stricter rules."""
-    if block["type"] != 0 or not block.get("lines"):
-        return False
-    line = block["lines"][0]
-    if not line.get("spans"):
-        return False
-    span = line["spans"][0]
-    text = "".join(s["text"] for s in line["spans"]).strip()
-    word_count = len(text.split())
-    if word_count > 15:
-        return False
-    is_bold = "bold" in span["font"].lower()
-    is_larger = round(span["size"]) > body_text_size
-    # Also consider all-caps text as a heading style for visual docs
-    is_all_caps = text.isupper() and word_count >= 3 and word_count < 10
-
-    if not is_larger and not is_bold and not is_all_caps:
-        return False
-    return True
-
-def get_heading_level(text, size, font, style_map):
-    """Gets level from numbering, then style, then capitalization."""
-    text = text.strip()
-    # Priority 1: Numbering
-    if re.match(r'^\d{1,2}\.\d{1,2}\.\d{1,2}', text): return "H3"
-    if re.match(r'^\d{1,2}\.\d{1,2}', text): return "H2"
-    if re.match(r'^\d{1,2}\.?\s', text): return "H1"
-
-    # Priority 2: Font Style from map
-    if (size, font) in style_map:
-        return style_map.get((size, font))
-
-    # Priority 3: Fallback for all-caps text in visual docs
-    if text.isupper():
-        return "H1"
+# --- Heading classification engine ---
+# PATCH: Multilingual regex for numbering, compiled once instead of per block
+NUM_PATTERN = r'[\d一二三四五六七八九十百千万億壹貳叁肆伍陸柒捌玖拾零〇１-９]+'
+H3_PATTERN = re.compile(rf'^{NUM_PATTERN}\.{NUM_PATTERN}\.{NUM_PATTERN}')
+H2_PATTERN = re.compile(rf'^{NUM_PATTERN}\.{NUM_PATTERN}|[（(]{NUM_PATTERN}[)）]')
+H1_PATTERN = re.compile(rf'^(Chapter\s+|第)?{NUM_PATTERN}[\.、．]?\s')
+STANDALONE_NUMBER = re.compile(r'[\d\.]+\s*')
+WHITESPACE = re.compile(r'\s+')
 
-    return None
 
+@lru_cache(maxsize=1024)
+def is_bold_font(font):
+    """Style map shared across pages and documents: font name -> bold flag."""
+    return "bold" in font.lower()
 
-def extract_from_flyer(doc, lang):
-    """Specialized function for single-page, visual documents."""
-    page = doc.load_page(0)
-    max_score = 0
-    hero_heading = None
-    title = "" # Flyers/invitations usually don't have a formal title
 
-    for block in page.get_text("dict")["blocks"]:
-        if block["type"] == 0 and block.get("lines") and block["lines"][0].get("spans"):
-            span = block["lines"][0]["spans"][0]
-            text = " ".join(s["text"] for s in block["lines"][0]["spans"]).strip()
-            if not text or len(text) > 50: continue
+def block_text(block):
+    """Joins every span of a text block with single spaces."""
+    return " ".join(s['text'] for l in block['lines'] for s in l['spans']).strip()
 
-            # Calculate a prominence score, heavily favoring font size
-            score = span["size"] * span["size"]
-            if "bold" in span["font"].lower(): score *= 1.2
-            # PATCH: Only apply capitalization score to Latin scripts
-            if lang == "LATIN" and text.isupper(): score *= 1.1
 
-            if score > max_score:
-                max_score = score
-                hero_heading = {"level": "H1", "text": text, "page": 0}
+class PageFeatures:
+    """
+    Compact feature table for a page's text blocks, one row per block. Only the
+    font size column is built for every block; text columns are built just for
+    the rows a caller asks for, since the size test already rules out body text.
+    """
 
-    outline = [hero_heading] if hero_heading else []
+    def __init__(self, pairs):
+        n = len(pairs)
+        self.blocks = [block for block, _ in pairs]
+        self.raw_texts = [text for _, text in pairs]
+        self.first_spans = [block['lines'][0].get('spans') for block in self.blocks]
+        self.has_spans = np.fromiter((bool(spans) for spans in self.first_spans), dtype=bool, count=n)
+        self.size = np.fromiter((spans[0]['size'] if spans else 0.0 for spans in self.first_spans), dtype=float, count=n)
+
+    @property
+    def rounded_size(self):
+        # np.round rounds half to even, the same as Python's round()
+        return np.round(self.size)
+
+    def text_columns(self, rows):
+        """Whitespace-normalized block texts of the given rows, with their char and word counts."""
+        texts = [WHITESPACE.sub(' ', self.raw_texts[i]) for i in rows]
+        chars = np.fromiter(map(len, texts), dtype=np.int32, count=len(texts))
+        words = np.fromiter((len(text.split()) for text in texts), dtype=np.int32, count=len(texts))
+        return texts, chars, words
+
+    def first_line_columns(self):
+        """Text of every block's first line, with its bold, all-caps and length flags."""
+        line_texts = [" ".join(s['text'] for s in spans).strip() if spans else "" for spans in self.first_spans]
+        bold = np.fromiter((bool(spans) and is_bold_font(spans[0]['font']) for spans in self.first_spans), dtype=bool, count=len(line_texts))
+        caps = np.fromiter((text.isupper() for text in line_texts), dtype=bool, count=len(line_texts))
+        line_chars = np.fromiter(map(len, line_texts), dtype=np.int32, count=len(line_texts))
+        return line_texts, bold, caps, line_chars
+
+
+def text_block_pairs(blocks):
+    """Returns (block, text) pairs for the text blocks of a page."""
+    return [(block, block_text(block)) for block in blocks if block['type'] == 0 and block.get('lines')]
+
+
+def merge_number_blocks(blocks):
+    """
+    Merges standalone heading numbers ("2.1") into the text block that follows them
+    on the same line. Returns (block, text) pairs for the page's text blocks.
+    """
+    texts = [block_text(b) if b['type'] == 0 and b.get('lines') else None for b in blocks]
+    pairs = []
+    i = 0
+    while i < len(blocks):
+        block, text = blocks[i], texts[i]
+        if text is None:
+            i += 1
+            continue
+        if STANDALONE_NUMBER.fullmatch(text) and i + 1 < len(blocks):
+            next_block, next_text = blocks[i + 1], texts[i + 1]
+            if next_text is not None and abs(block['bbox'][1] - next_block['bbox'][1]) < 5:
+                block['lines'][0]['spans'][0]['text'] = f"{text} {next_text}"
+                pairs.append((block, block_text(block)))
+                i += 2
+                continue
+        pairs.append((block, text))
+        i += 1
+    return pairs
+
+
+def heading_level(text, word_count):
+    """Gets the level from numbering, falling back to H1 for short un-numbered headings."""
+    if H3_PATTERN.match(text): return "H3"
+    if H2_PATTERN.match(text): return "H2"
+    if H1_PATTERN.match(text): return "H1"
+    if word_count < 7: return "H1"
+    return None
+
+
+def extract_from_flyer(layout, lang):
+    """Specialized function for single-page, visual documents."""
+    title = "" # Flyers/invitations usually don't have a formal title
+    features = PageFeatures(text_block_pairs(layout[0]))
+    line_texts, bold, caps, line_chars = features.first_line_columns()
+
+    # Calculate a prominence score, heavily favoring font size
+    score = features.size * features.size
+    score = np.where(bold, score * 1.2, score)
+    # PATCH: Only apply capitalization score to Latin scripts
+    if lang == "LATIN":
+        score = np.where(caps, score * 1.1, score)
+    valid = features.has_spans & (line_chars > 0) & (line_chars <= 50)
+    score = np.where(valid, score, 0)
+
+    outline = []
+    if score.size and score.max() > 0:
+        # argmax returns the first maximum, matching a strict ">" scan in reading order
+        best = int(np.argmax(score))
+        outline.append({"level": "H1", "text": line_texts[best], "page": 0})
     return {"title": title, "outline": outline}
 
 
@@ -114,123 +209,380 @@ def extract_outline(pdf_path):
     """
     Extracts outline, now with a pre-processing step to merge separated heading numbers and text.
     """
+    name = os.path.basename(pdf_path)
     try:
-        doc = fitz.open(pdf_path)
+        with profiling.stage("open", document=name):
+            doc = fitz.open(pdf_path)
         if not doc or doc.page_count == 0:
             return {"title": "", "outline": []}
     except Exception:
         return {"title": "", "outline": []}
 
+    # Parse every page exactly once; all passes below share this copy
+    with profiling.stage("text_extraction", document=name):
+        layout = extract_layout(doc)
+    profiling.count(name, pages=doc.page_count, blocks=sum(len(blocks) for blocks in layout))
+
     # PATCH: Add language detection
-    lang = detect_language(doc)
+    with profiling.stage("language_detection", document=name):
+        lang = detect_language(layout)
 
     # Divert single-page documents to the specialized flyer function if needed
     if doc.page_count == 1:
+        doc.close()
         # PATCH: Pass language to the flyer function
-        return extract_from_flyer(doc, lang)
+        with profiling.stage("heading_classification", document=name):
+            result = extract_from_flyer(layout, lang)
+        profiling.count(name, headings=len(result["outline"]))
+        return result
     
+    title = get_document_title(doc)
+    outline = []
+    found_headings = set()
+    # Find body size just once
+    with profiling.stage("body_size_histogram", document=name):
+        font_sizes = Counter(round(span["size"]) for blocks in layout for span in iter_spans(blocks))
+        body_size = font_sizes.most_common(1)[0][0] if font_sizes else 12
+    doc.close()
+
+    with profiling.stage("heading_classification", document=name):
+        for page_num, blocks in enumerate(layout):
+            outline.extend(classify_page_headings(blocks, page_num, body_size, lang, found_headings))
+    profiling.count(name, headings=len(outline))
+
+    return {"title": title, "outline": outline}
+
+
+def get_document_title(doc):
+    """Returns the metadata title, or "" when it is missing or just a filename."""
     title = doc.metadata.get('title', '').strip()
     if not title or len(title) < 5 or any(ext in title.lower() for ext in [".doc", ".pdf", ".cdr"]):
         title = ""
+    return title
 
-    outline = []
+
+def classify_page_headings(blocks, page_num, body_size, lang, found_headings):
+    """
+    Returns the outline entries found on one page.
+    found_headings is shared across pages so repeated headings are only reported once.
+    """
+    features = PageFeatures(merge_number_blocks(blocks))
+    sized = np.flatnonzero(features.has_spans & (features.rounded_size > body_size))
+    texts, chars, words = features.text_columns(sized)
+    # PATCH: Language-aware length check
+    too_long = chars > 50 if lang == "CJK" else words > 25
+    candidates = np.flatnonzero((chars > 0) & ~too_long)
+
+    entries = []
+    for i in candidates:
+        full_text = texts[i]
+        if full_text in found_headings:
+            continue
+        level = heading_level(full_text, words[i])
+        if level:
+            entries.append({
+                "level": level,
+                "text": full_text,
+                "page": page_num
+            })
+            found_headings.add(full_text)
+
+    return entries
+
+
+# --- Streaming mode for very large documents ---
+STREAM_SAMPLE_PAGES = 20
+STREAM_STORE_SHRINK_EVERY = 50
+
+
+def sample_page_numbers(page_count, sample_size=STREAM_SAMPLE_PAGES):
+    """Picks the first 3 pages (for language detection) plus evenly spaced pages across the document."""
+    if page_count <= sample_size:
+        return list(range(page_count))
+    step = page_count / sample_size
+    picks = {0, 1, 2} | {int(i * step) for i in range(sample_size)}
+    return sorted(picks)
+
+
+def iter_doc_outline(doc, sample_size=STREAM_SAMPLE_PAGES):
+    """
+    Yields outline entries from an open document one page at a time.
+    The body size is first estimated from a page sample and then refined with
+    every page read, so the font-size histogram never has to be complete before
+    the first heading is classified. Pages are released as soon as they are done.
+    """
+    page_count = doc.page_count
+    if page_count == 0:
+        return
+
+    sampled = sample_page_numbers(page_count, sample_size)
+    font_sizes = Counter()
+    first_pages = []
+    for page_num in sampled:
+        blocks = load_page_blocks(doc.load_page(page_num))
+        font_sizes.update(round(span["size"]) for span in iter_spans(blocks))
+        if page_num < 3:
+            first_pages.append(blocks)
+    lang = detect_language(first_pages)
+
+    if page_count == 1:
+        yield from extract_from_flyer(first_pages, lang)["outline"]
+        return
+
+    sampled = set(sampled)
     found_headings = set()
-    # Find body size just once
-    font_sizes = Counter(round(span["size"]) for page in doc for block in page.get_text("dict")["blocks"] if block["type"]==0 for line in block.get("lines",[]) for span in line.get("spans",[]))
-    body_size = font_sizes.most_common(1)[0][0] if font_sizes else 12
+    for page_num in range(page_count):
+        blocks = load_page_blocks(doc.load_page(page_num))
+        if page_num not in sampled:
+            font_sizes.update(round(span["size"]) for span in iter_spans(blocks))
+        body_size = font_sizes.most_common(1)[0][0] if font_sizes else 12
+        yield from classify_page_headings(blocks, page_num, body_size, lang, found_headings)
+        del blocks
+        if page_num % STREAM_STORE_SHRINK_EVERY == STREAM_STORE_SHRINK_EVERY - 1:
+            # Drop MuPDF's cached fonts/images so RSS does not grow with page count
+            fitz.TOOLS.store_shrink(100)
+
+
+def iter_outline(pdf_path, sample_size=STREAM_SAMPLE_PAGES):
+    """Generator version of extract_outline for documents too large to hold in memory."""
+    try:
+        doc = fitz.open(pdf_path)
+    except Exception:
+        return
+    with doc:
+        yield from iter_doc_outline(doc, sample_size)
 
-    for page_num, page in enumerate(doc):
-        # Pre-process blocks on each page to merge separated headings
-        try:
-            # Using sort=True helps ensure correct reading order for merging
-            blocks = page.get_text("dict", sort=True)["blocks"]
-        except Exception:
-            blocks = page.get_text("dict")["blocks"]
-
-        processed_blocks = []
-        i = 0
-        while i < len(blocks):
-            block = blocks[i]
-            if block['type'] != 0 or not block.get('lines'):
-                processed_blocks.append(block)
-                i += 1
-                continue
 
-            current_text = " ".join(s['text'] for l in block['lines'] for s in l['spans']).strip()
-            is_standalone_number = re.fullmatch(r'[\d\.]+\s*', current_text)
+def write_outline_jsonl(pdf_path, output_path, sample_size=STREAM_SAMPLE_PAGES):
+    """
+    Streams a document's outline to JSON Lines: a {"title": ...} record followed by
+    one record per heading, flushed as each heading is found. Returns the heading count.
+    """
+    count = 0
+    tmp_path = output_path + ".tmp"
+    with fitz.open(pdf_path) as doc, open(tmp_path, 'w', encoding='utf-8', buffering=1) as f:
+        title = get_document_title(doc) if doc.page_count > 1 else ""
+        f.write(json.dumps({"title": title}, ensure_ascii=False) + "\n")
+        for entry in iter_doc_outline(doc, sample_size):
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            count += 1
+    os.replace(tmp_path, output_path)
+    return count
 
-            if is_standalone_number and i + 1 < len(blocks):
-                next_block = blocks[i+1]
-                if next_block['type'] == 0 and next_block.get('lines') and abs(block['bbox'][1] - next_block['bbox'][1]) < 5:
-                    next_text = " ".join(s['text'] for l in next_block['lines'] for s in l['spans']).strip()
-                    block['lines'][0]['spans'][0]['text'] = f"{current_text.strip()} {next_text}"
-                    processed_blocks.append(block)
-                    i += 2
-                    continue
-            
-            processed_blocks.append(block)
-            i += 1
-        # End of new pre-processing step
 
-        # Run heading detection on the processed (potentially merged) blocks
-        for block in processed_blocks:
-            if block['type'] == 0 and block.get("lines"):
-                full_text = " ".join(s['text'] for l in block['lines'] for s in l['spans']).strip()
-                full_text = re.sub(r'\s+', ' ', full_text)
+def write_outline(result, output_path):
+    """Writes one outline JSON atomically so a killed worker never leaves a partial file."""
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, output_path)
 
-                # PATCH: Language-aware length check
-                is_too_long = len(full_text) > 50 if lang == "CJK" else len(full_text.split()) > 25
-                if not full_text or full_text in found_headings or is_too_long:
-                    continue
-                
-                first_span = block['lines'][0]['spans'][0]
-                if round(first_span['size']) > body_size:
-                    level = None
-                    # PATCH: Multilingual regex for numbering
-                    num_pattern = r'[\d一二三四五六七八九十百千万億壹貳叁肆伍陸柒捌玖拾零〇１-９]+'
-                    h3_pattern = re.compile(f'^{num_pattern}\.{num_pattern}\.{num_pattern}')
-                    h2_pattern = re.compile(f'^{num_pattern}\.{num_pattern}|[（(]{num_pattern}[)）]')
-                    h1_pattern = re.compile(f'^(Chapter\s+|第)?{num_pattern}[\.、．]?\s')
-
-                    if h3_pattern.match(full_text): level = "H3"
-                    elif h2_pattern.match(full_text): level = "H2"
-                    elif h1_pattern.match(full_text): level = "H1"
-                    
-                    # Fallback for non-numbered headings
-                    if not level:
-                        if len(full_text.split()) < 7:
-                            level = "H1"
-
-                    if level:
-                        outline.append({
-                            "level": level,
-                            "text": full_text,
-                            "page": page_num
-                        })
-                        found_headings.add(full_text)
 
-    doc.close()
-    return {"title": title, "outline": outline}
+def list_pdfs(input_dir):
+    """Returns the sorted PDF filenames found in input_dir."""
+    return sorted(f for f in os.listdir(input_dir) if f.lower().endswith(".pdf"))
+
 
+def output_path_for(output_dir, filename, stream=False):
+    """Maps an input PDF name to its .json (or .jsonl in streaming mode) output path."""
+    ext = ".jsonl" if stream else ".json"
+    return os.path.join(output_dir, f"{os.path.splitext(filename)[0]}{ext}")
 
-def process_files():
+
+def process_files(input_dir="/app/input", output_dir="/app/output", stream=False):
     """Main function to process all PDFs in the input directory."""
-    input_dir = "/app/input"
-    output_dir = "/app/output"
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    for filename in os.listdir(input_dir):
-        if filename.lower().endswith(".pdf"):
+    for filename in list_pdfs(input_dir):
+        pdf_path = os.path.join(input_dir, filename)
+        output_path = output_path_for(output_dir, filename, stream)
+        try:
+            with profiling.stage("document", document=filename):
+                if stream:
+                    with profiling.stage("stream_outline", document=filename):
+                        write_outline_jsonl(pdf_path, output_path)
+                else:
+                    result = extract_outline(pdf_path)
+                    with profiling.stage("json_write", document=filename):
+                        write_outline(result, output_path)
+            print(f"✅ Successfully processed {filename}")
+        except Exception as e:
+            print(f"❌ Failed to process {filename}: {e}")
+
+
+# --- Parallel batch mode ---
+def _vm_size_bytes():
+    """Virtual address space this process already uses (0 where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def _batch_worker(filename, pdf_path, output_path, max_memory_mb, stream, conn, profile=False):
+    """Runs in a child process: extracts one PDF, writes its JSON and reports back."""
+    start = time.time()
+    if profile:
+        profiling.enable()
+    record = {"file": filename, "status": "ok", "pages": 0, "headings": 0, "error": None}
+    if max_memory_mb and resource is not None:
+        # The forked child already maps the parent's interpreter, MuPDF and BLAS buffers;
+        # the budget covers only what this document adds on top of that
+        limit = _vm_size_bytes() + int(max_memory_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    try:
+        with fitz.open(pdf_path) as doc:
+            record["pages"] = doc.page_count
+        with profiling.stage("document", document=filename):
+            if stream:
+                with profiling.stage("stream_outline", document=filename):
+                    record["headings"] = write_outline_jsonl(pdf_path, output_path)
+            else:
+                result = extract_outline(pdf_path)
+                with profiling.stage("json_write", document=filename):
+                    write_outline(result, output_path)
+                record["headings"] = len(result["outline"])
+    except MemoryError:
+        record["status"] = "memory"
+        record["error"] = f"exceeded memory budget of {max_memory_mb} MB"
+    except Exception as e:
+        # MuPDF reports allocation failures as plain errors rather than MemoryError
+        record["status"] = "memory" if max_memory_mb and "malloc" in str(e) else "failed"
+        record["error"] = str(e)
+    record["seconds"] = round(time.time() - start, 3)
+    if resource is not None:
+        # ru_maxrss is reported in kilobytes on Linux
+        record["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    if profile:
+        record["profile"] = profiling.disable().export()
+    conn.send(record)
+    conn.close()
+
+
+def process_files_parallel(input_dir, output_dir, workers=None, timeout=None, max_memory_mb=None, summary_path=None, stream=False):
+    """
+    Processes every PDF in input_dir with up to `workers` child processes.
+    Each document gets its own process so a hung or oversized PDF can be killed
+    (timeout) or capped (max_memory_mb) without stalling the rest of the batch.
+    JSON files are written as soon as each document finishes, and a summary of
+    the run is written to summary_path.
+    """
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    if summary_path is None:
+        summary_path = os.path.join(output_dir, "_batch_summary.json")
+
+    run_start = time.time()
+    pending = deque(list_pdfs(input_dir))
+    total = len(pending)
+    running = {}  # filename -> (process, result pipe, start time)
+    records = {}
+
+    def finish(record):
+        if profiling.active() is not None:
+            profiling.active().merge(record.pop("profile", None))
+        records[record["file"]] = record
+        icon = "✅" if record["status"] == "ok" else "❌"
+        detail = f"{record['pages']} pages" if record["status"] == "ok" else f"{record['status']}: {record['error']}"
+        print(f"{icon} [{len(records)}/{total}] {record['file']} ({detail}, {record['seconds']:.2f}s)")
+
+    while pending or running:
+        while pending and len(running) < workers:
+            filename = pending.popleft()
             pdf_path = os.path.join(input_dir, filename)
-            output_path = os.path.join(output_dir, f"{os.path.splitext(filename)[0]}.json")
+            output_path = output_path_for(output_dir, filename, stream)
+            # A plain pipe needs no feeder thread, so it still works under a tight RLIMIT_AS
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            proc = multiprocessing.Process(target=_batch_worker, args=(filename, pdf_path, output_path, max_memory_mb, stream, sender, profiling.active() is not None), daemon=True)
+            proc.start()
+            sender.close()
+            running[filename] = (proc, receiver, time.time())
+
+        multiprocessing.connection.wait([conn for _, conn, _ in running.values()], timeout=0.05)
+
+        for filename, (proc, conn, started) in list(running.items()):
+            elapsed = time.time() - started
+            record = None
             try:
-                result = extract_outline(pdf_path)
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    json.dump(result, f, ensure_ascii=False, indent=4)
-                print(f"✅ Successfully processed {filename}")
-            except Exception as e:
-                print(f"❌ Failed to process {filename}: {e}")
+                if conn.poll():
+                    record = conn.recv()
+            except EOFError:
+                pass
+            if record is None and proc.is_alive():
+                if not timeout or elapsed <= timeout:
+                    continue
+                proc.kill()
+                record = {"file": filename, "status": "timeout", "pages": 0, "headings": 0, "error": f"exceeded {timeout}s time budget", "seconds": round(elapsed, 3)}
+            if record is None:
+                # The worker may have sent its record and exited after the first poll
+                try:
+                    if conn.poll():
+                        record = conn.recv()
+                except EOFError:
+                    pass
+            if record is None:
+                # Died without reporting, e.g. killed by the kernel OOM killer
+                record = {"file": filename, "status": "crashed", "pages": 0, "headings": 0, "error": f"worker exited with code {proc.exitcode}", "seconds": round(elapsed, 3)}
+            proc.join()
+            conn.close()
+            del running[filename]
+            if record["status"] != "ok":
+                # A worker stopped mid-write leaves its partial file behind
+                tmp_path = output_path_for(output_dir, filename, stream) + ".tmp"
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            finish(record)
+
+    files = [records[f] for f in sorted(records)]
+    counts = Counter(r["status"] for r in files)
+    summary = {
+        "input_dir": input_dir,
+        "output_dir": output_dir,
+        "workers": workers,
+        "timeout": timeout,
+        "max_memory_mb": max_memory_mb,
+        "stream": stream,
+        "total_files": total,
+        "succeeded": counts.get("ok", 0),
+        "failed": total - counts.get("ok", 0),
+        "status_counts": dict(counts),
+        "total_pages": sum(r["pages"] for r in files),
+        "wall_seconds": round(time.time() - run_start, 3),
+        "files": files,
+    }
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=4)
+    print(f"Processed {total} files in {summary['wall_seconds']:.2f}s ({summary['succeeded']} ok, {summary['failed']} failed). Summary: {summary_path}")
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract H1/H2/H3 outlines from PDFs.")
+    parser.add_argument("--input", default="/app/input", help="directory containing the PDFs")
+    parser.add_argument("--output", default="/app/output", help="directory for the JSON outlines")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (0 = one per CPU)")
+    parser.add_argument("--timeout", type=float, default=None, help="per-file time budget in seconds")
+    parser.add_argument("--max-memory-mb", type=int, default=None, help="memory (address space) each file may add on top of what its worker starts with, in MB")
+    parser.add_argument("--summary", default=None, help="where to write the batch summary JSON")
+    parser.add_argument("--stream", action="store_true", help="stream headings to JSON Lines with bounded memory (for very large PDFs)")
+    parser.add_argument("--profile", default=None, metavar="TRACE_JSON",
+                        help="record per-stage wall/CPU time and peak memory, write a Chrome trace here and print a summary table")
+    return parser.parse_args(argv)
+
 
 if __name__ == "__main__":
-    process_files()
\ No newline at end of file
+    args = parse_args()
+    if args.profile:
+        profiling.enable()
+    if args.workers == 1 and args.timeout is None and args.max_memory_mb is None and args.summary is None:
+        process_files(args.input, args.output, stream=args.stream)
+    else:
+        process_files_parallel(args.input, args.output, workers=args.workers or None, timeout=args.timeout,
+                               max_memory_mb=args.max_memory_mb, summary_path=args.summary, stream=args.stream)
+    if args.profile:
+        profiler = profiling.disable()
+        profiler.write_trace(args.profile)
+        print(profiler.format_summary())
+        print(f"Profile trace written to {args.profile}")
@@ -0,0 +1,200 @@
+"""
+Opt-in stage profiler.
+
+Disabled by default: stage() then returns a no-op context manager and count()
+returns immediately, so instrumented code pays almost nothing. Once enabled,
+every stage records its wall time, CPU time and peak resident memory, and
+per-document counters (pages, blocks, sections, tokens, ...) are collected.
+The result can be written as a Chrome trace (chrome://tracing or Perfetto)
+and printed as a summary table.
+
+Stage times are inclusive: a stage that contains other stages also counts
+their time. CPU time is process-wide, so it includes helper threads such as
+the model's BLAS threads. Peak memory is the highest RSS sampled while the
+stage was running (every few milliseconds, plus at its start and end).
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+SAMPLE_INTERVAL = 0.005  # seconds between RSS samples
+
+_PROFILER = None
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def rss_bytes():
+    """Current resident set size of this process, or its high-water mark where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Profiler:
+    """Collects stage timings and document counters for one process."""
+
+    def __init__(self, sample_interval=SAMPLE_INTERVAL):
+        self.pid = os.getpid()
+        self.events = []
+        self.documents = {}
+        self._open = {}  # id -> highest RSS seen while that stage is open
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, args=(sample_interval,), name="profiler-rss", daemon=True)
+        self._sampler.start()
+
+    def _sample(self, interval):
+        while not self._stop.wait(interval):
+            rss = rss_bytes()
+            with self._lock:
+                for key, peak in self._open.items():
+                    if rss > peak:
+                        self._open[key] = rss
+
+    @contextmanager
+    def stage(self, name, **args):
+        rss_start = rss_bytes()
+        key = object()
+        with self._lock:
+            self._open[key] = rss_start
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall_end, cpu_end = time.perf_counter(), time.process_time()
+            rss_end = rss_bytes()
+            with self._lock:
+                peak = max(self._open.pop(key), rss_end)
+                self.events.append({
+                    "name": name, "start": wall_start, "wall": wall_end - wall_start, "cpu": cpu_end - cpu_start,
+                    "peak_rss": peak, "rss_delta": rss_end - rss_start,
+                    "pid": self.pid, "tid": threading.get_native_id(), "args": args,
+                })
+
+    def count(self, document, **counters):
+        with self._lock:
+            totals = self.documents.setdefault(document, {})
+            for name, value in counters.items():
+                totals[name] = totals.get(name, 0) + value
+
+    def close(self):
+        self._stop.set()
+        self._sampler.join()
+
+    # --- Moving results between processes ---
+    def export(self):
+        """Returns everything recorded as plain data, e.g. to send back from a worker process."""
+        with self._lock:
+            return {"events": list(self.events), "documents": {d: dict(c) for d, c in self.documents.items()}}
+
+    def merge(self, data):
+        """Adds the events and counters exported by another (worker) profiler."""
+        if not data:
+            return
+        with self._lock:
+            self.events.extend(data["events"])
+        for document, counters in data["documents"].items():
+            self.count(document, **counters)
+
+    # --- Reports ---
+    def summary(self):
+        """Per-stage totals, slowest stage first."""
+        stages = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            s = stages.setdefault(event["name"], {"stage": event["name"], "calls": 0, "wall_ms": 0.0, "cpu_ms": 0.0, "max_wall_ms": 0.0, "peak_rss_mb": 0.0})
+            s["calls"] += 1
+            s["wall_ms"] += event["wall"] * 1000
+            s["cpu_ms"] += event["cpu"] * 1000
+            s["max_wall_ms"] = max(s["max_wall_ms"], event["wall"] * 1000)
+            s["peak_rss_mb"] = max(s["peak_rss_mb"], event["peak_rss"] / 2**20)
+        rows = sorted(stages.values(), key=lambda s: s["wall_ms"], reverse=True)
+        for s in rows:
+            for key in ("wall_ms", "cpu_ms", "max_wall_ms", "peak_rss_mb"):
+                s[key] = round(s[key], 2)
+        return rows
+
+    def format_summary(self):
+        lines = [f"{'stage':<24} {'calls':>6} {'wall ms':>10} {'cpu ms':>10} {'max ms':>9} {'peak MB':>8}"]
+        for s in self.summary():
+            lines.append(f"{s['stage']:<24} {s['calls']:>6} {s['wall_ms']:>10.1f} {s['cpu_ms']:>10.1f} {s['max_wall_ms']:>9.1f} {s['peak_rss_mb']:>8.1f}")
+        if self.documents:
+            names = sorted({name for counters in self.documents.values() for name in counters})
+            lines.append("")
+            lines.append(f"{'document':<40} " + " ".join(f"{n:>10}" for n in names))
+            for document, counters in sorted(self.documents.items()):
+                label = document if len(document) <= 40 else document[:37] + "..."
+                lines.append(f"{label:<40} " + " ".join(f"{counters.get(n, 0):>10}" for n in names))
+        return "\n".join(lines)
+
+    def trace(self):
+        """The recorded stages in Chrome trace-event format."""
+        with self._lock:
+            events = list(self.events)
+        origin = min((e["start"] for e in events), default=0.0)
+        trace_events = [{
+            "name": e["name"], "cat": "stage", "ph": "X",
+            "ts": round((e["start"] - origin) * 1e6, 1), "dur": round(e["wall"] * 1e6, 1),
+            "pid": e["pid"], "tid": e["tid"],
+            "args": {"cpu_ms": round(e["cpu"] * 1000, 3), "peak_rss_mb": round(e["peak_rss"] / 2**20, 2),
+                     "rss_delta_mb": round(e["rss_delta"] / 2**20, 2), **e["args"]},
+        } for e in sorted(events, key=lambda e: e["start"])]
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms",
+                "otherData": {"summary": self.summary(), "documents": self.documents}}
+
+    def write_trace(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.trace(), f, ensure_ascii=False)
+
+
+# --- Module-level switch used by the instrumented code ---
+def enable(sample_interval=SAMPLE_INTERVAL):
+    """Starts profiling this process and returns the profiler."""
+    global _PROFILER
+    # A forked worker inherits its parent's profiler (without the sampler thread); start afresh
+    if _PROFILER is None or _PROFILER.pid != os.getpid():
+        _PROFILER = Profiler(sample_interval)
+    return _PROFILER
+
+
+def disable():
+    """Stops profiling and returns the profiler with everything it recorded (None if it was not enabled)."""
+    global _PROFILER
+    profiler, _PROFILER = _PROFILER, None
+    if profiler is not None:
+        profiler.close()
+    return profiler
+
+
+def active():
+    return _PROFILER
+
+
+def stage(name, **args):
+    """Times the enclosed block as `name` when profiling is enabled; a no-op otherwise."""
+    if _PROFILER is None:
+        return nullcontext()
+    return _PROFILER.stage(name, **args)
+
+
+def count(document, **counters):
+    """Adds to a document's counters when profiling is enabled."""
+    if _PROFILER is not None:
+        _PROFILER.count(document, **counters)
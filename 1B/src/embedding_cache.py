@@ -0,0 +1,206 @@
+"""
+Persistent, content-addressed embedding cache.
+
+Each embedding is stored under sha1(model fingerprint + text) in a set of
+memory-mapped files, so reruns over unchanged documents skip the transformer:
+
+    meta.json    dimension, capacity and the LRU clock
+    vectors.f32  float32 matrix, one row per slot
+    keys.bin     20-byte sha1 digest per slot (all zeros = free slot)
+    ticks.i64    last-used clock value per slot, for LRU eviction
+
+A slot's key is written after its vector, and lookups check the key stored in
+the slot, so an interrupted run can never return another text's embedding.
+"""
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+DIGEST_SIZE = 20
+CACHE_VERSION = 1
+MIN_CAPACITY = 1024
+
+
+def model_fingerprint(model_path):
+    """
+    Identifies a model by directory name plus the names and contents of its files, so
+    re-exported or fine-tuned weights of the same size never reuse old embeddings.
+    Reads every file, so callers should compute it once per model.
+    """
+    digest = hashlib.sha1(os.path.basename(os.path.normpath(model_path)).encode("utf-8"))
+    for root, dirs, files in os.walk(model_path):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(f"|{os.path.relpath(path, model_path)}:".encode("utf-8"))
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+class EmbeddingCache:
+    """Size-bounded LRU cache of embeddings backed by memory-mapped NumPy files."""
+
+    def __init__(self, cache_dir, model_id, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.model_id = model_id
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self.dim = None
+        self.capacity = 0
+        self.clock = 0
+        self.slots = {}  # digest -> slot
+        self.free = []
+        self._lock = threading.RLock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    # --- Storage ---
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _load(self):
+        meta_path = self._path("meta.json")
+        if not os.path.exists(meta_path):
+            return
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("version") != CACHE_VERSION:
+                raise ValueError(f"cache version {meta.get('version')} != {CACHE_VERSION}")
+            self.dim, self.capacity, self.clock = meta["dim"], meta["capacity"], meta["clock"]
+            self._open_maps()
+        except (OSError, ValueError, KeyError) as e:
+            print(f"--> [Warning] Embedding cache at '{self.cache_dir}' is unreadable, starting empty. Error: {e}")
+            self.dim, self.capacity, self.clock = None, 0, 0
+            return
+        self.slots = {}
+        for i in np.flatnonzero(self.keys.any(axis=1)):
+            key = self.keys[i].tobytes()
+            if key in self.slots:
+                self.keys[i] = 0  # a duplicate written by an older version; reclaim its slot
+            else:
+                self.slots[key] = int(i)
+        self.free = sorted(set(range(self.capacity)) - set(self.slots.values()), reverse=True)
+
+    def _open_maps(self):
+        self.vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        self.keys = np.memmap(self._path("keys.bin"), dtype=np.uint8, mode="r+", shape=(self.capacity, DIGEST_SIZE))
+        self.ticks = np.memmap(self._path("ticks.i64"), dtype=np.int64, mode="r+", shape=(self.capacity,))
+
+    def _resize(self, capacity):
+        """Grows the backing files to `capacity` slots; new slots are zero-filled (free)."""
+        if self.capacity:
+            self.flush()
+            del self.vectors, self.keys, self.ticks
+        for name, row_bytes in (("vectors.f32", self.dim * 4), ("keys.bin", DIGEST_SIZE), ("ticks.i64", 8)):
+            # A fresh cache must not inherit rows from files left behind without metadata
+            with open(self._path(name), "ab" if self.capacity else "wb") as f:
+                f.truncate(capacity * row_bytes)
+        self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+        self._open_maps()
+
+    @property
+    def max_entries(self):
+        return max(1, self.max_bytes // (self.dim * 4 + DIGEST_SIZE + 8))
+
+    def _allocate(self, count):
+        """Returns `count` free slots, growing the files or evicting LRU entries as needed."""
+        if len(self.free) < count and self.capacity < self.max_entries:
+            wanted = max(MIN_CAPACITY, self.capacity * 2, len(self.slots) + count)
+            self._resize(min(wanted, self.max_entries))
+        if len(self.free) < count:
+            self._evict(count - len(self.free))
+        return [self.free.pop() for _ in range(min(count, len(self.free)))]
+
+    def _evict(self, count):
+        # Evict at least 10% at a time so a full cache does not sort on every insert
+        count = min(len(self.slots), max(count, self.max_entries // 10))
+        used = np.fromiter(self.slots.values(), dtype=np.int64, count=len(self.slots))
+        oldest = used[np.argsort(self.ticks[used], kind="stable")[:count]]
+        for slot in oldest:
+            del self.slots[self.keys[slot].tobytes()]
+            self.keys[slot] = 0
+            self.free.append(int(slot))
+        self.evictions += len(oldest)
+
+    # --- Public API ---
+    def digest(self, text):
+        return hashlib.sha1(f"{self.model_id}\0{text}".encode("utf-8")).digest()
+
+    def encode(self, texts, encode_fn):
+        """
+        Returns embeddings for `texts`, calling encode_fn only on texts that are not cached.
+        encode_fn takes a list of strings and returns a (n, dim) array.
+        """
+        texts = list(texts)
+        with self._lock:
+            digests = [self.digest(t) for t in texts]
+            self.clock += 1
+            found, missing = {}, {}
+            for i, d in enumerate(digests):
+                slot = self.slots.get(d)
+                if slot is not None and self.keys[slot].tobytes() == d:
+                    found[i] = slot
+                    self.ticks[slot] = self.clock
+                else:
+                    missing.setdefault(d, []).append(i)
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+            # Copy hits now: once the lock is released an eviction may refill their slots
+            hit_vectors = np.array(self.vectors[list(found.values())], dtype=np.float32) if found else None
+
+        new_vectors = None
+        if missing:
+            first = [idx[0] for idx in missing.values()]
+            new_vectors = np.asarray(encode_fn([texts[i] for i in first]), dtype=np.float32)
+
+        with self._lock:
+            if self.dim is None:
+                if new_vectors is None:
+                    return np.zeros((0, 0), dtype=np.float32)
+                self.dim = new_vectors.shape[1]
+            out = np.empty((len(texts), self.dim), dtype=np.float32)
+            if found:
+                out[list(found)] = hit_vectors
+            if missing:
+                # Another thread may have stored the same text while the lock was released
+                fresh = [d for d in missing if d not in self.slots]
+                slots = dict(zip(fresh, self._allocate(len(fresh))))
+                for j, (d, indices) in enumerate(missing.items()):
+                    out[indices] = new_vectors[j]
+                    slot = slots.get(d)
+                    if slot is not None:
+                        self.vectors[slot] = new_vectors[j]
+                        self.keys[slot] = np.frombuffer(d, dtype=np.uint8)
+                        self.ticks[slot] = self.clock
+                        self.slots[d] = slot
+            return out
+
+    def flush(self):
+        """Flushes the memory maps and writes the metadata file."""
+        with self._lock:
+            if self.dim is None or not self.capacity:
+                return
+            for array in (self.vectors, self.keys, self.ticks):
+                array.flush()
+            tmp_path = self._path("meta.json.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump({"version": CACHE_VERSION, "dim": self.dim, "capacity": self.capacity, "clock": self.clock}, f)
+            os.replace(tmp_path, self._path("meta.json"))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self.slots),
+            "bytes": self.capacity * ((self.dim or 0) * 4 + DIGEST_SIZE + 8),
+        }
@@ -0,0 +1,311 @@
+"""
+Sentence encoder backends for the 1B ranker.
+
+Importing this module is cheap: torch/sentence-transformers and onnxruntime are
+only imported when a backend encodes its first batch, so `--help`, argument
+errors and fully cached runs never pay the model start-up cost.
+
+Backends:
+    torch  the original SentenceTransformer model, fp32
+    onnx   the same model exported to ONNX (optionally int8-quantized) and run
+           with onnxruntime; tokenization uses the model's tokenizer.json
+
+Usage:
+    python src/encoders.py export                  # write models/all-MiniLM-L6-v2-onnx (int8)
+    python src/encoders.py export --no-quantize    # fp32 ONNX export
+    python src/encoders.py parity                  # compare onnx against torch, report latency
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+import profiling
+
+from embedding_cache import model_fingerprint
+
+# Next to src/, as in the container (/project/models); MODEL_PATH / ONNX_MODEL_PATH override them
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models')
+DEFAULT_MODEL_PATH = os.environ.get("MODEL_PATH", os.path.join(MODELS_DIR, 'all-MiniLM-L6-v2'))
+DEFAULT_ONNX_PATH = os.environ.get("ONNX_MODEL_PATH", os.path.join(MODELS_DIR, 'all-MiniLM-L6-v2-onnx'))
+MAX_SEQ_LENGTH = 256  # matches sentence_bert_config.json
+BATCH_SIZE = 32
+MAX_BATCH_SIZE = 64
+TOKEN_BUDGET = 4096  # padded tokens per batch; larger batches were slower on CPU
+CHARS_PER_TOKEN = 4
+
+
+def length_buckets(texts, max_batch=MAX_BATCH_SIZE, token_budget=TOKEN_BUDGET):
+    """
+    Groups text indices into batches of similar length, longest first.
+    Batches are sized so (batch size x longest text) stays within token_budget
+    padded tokens: short titles go in large batches, long sections in small ones.
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    batch, longest = [], 0
+    for i in order:
+        tokens = min(MAX_SEQ_LENGTH, len(texts[i]) // CHARS_PER_TOKEN + 2)
+        if batch and (len(batch) >= max_batch or (len(batch) + 1) * longest > token_budget):
+            yield batch
+            batch = []
+        if not batch:
+            longest = tokens
+        batch.append(i)
+    if batch:
+        yield batch
+
+
+def encode_in_buckets(encode_batch, texts, max_batch=MAX_BATCH_SIZE):
+    """Runs encode_batch over length buckets of texts and scatters the rows back into input order."""
+    texts = list(texts)
+    embeddings = None
+    for indices in length_buckets(texts, max_batch):
+        longest = min(MAX_SEQ_LENGTH, len(texts[indices[0]]) // CHARS_PER_TOKEN + 2)
+        with profiling.stage("encode_batch", texts=len(indices), padded_tokens=len(indices) * longest):
+            vectors = np.asarray(encode_batch([texts[i] for i in indices]), dtype=np.float32)
+        if embeddings is None:
+            embeddings = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+        embeddings[indices] = vectors
+    return embeddings if embeddings is not None else np.zeros((0, 0), dtype=np.float32)
+
+
+def encode_groups(encode_fn, *groups):
+    """
+    Encodes several lists of texts with one call to encode_fn: every distinct string
+    is encoded once, and the rows are scattered back to one array per group.
+    """
+    unique = {}
+    for texts in groups:
+        for text in texts:
+            unique.setdefault(text, len(unique))
+    vectors = encode_fn(list(unique))
+    return [vectors[[unique[t] for t in texts]] for texts in groups]
+
+
+class SentenceTransformerEncoder:
+    """The original PyTorch SentenceTransformer, loaded on first use."""
+
+    name = "torch"
+
+    def __init__(self, model_path=DEFAULT_MODEL_PATH):
+        # Resolved now: the model is loaded lazily, possibly from another working directory
+        self.model_path = os.path.abspath(model_path)
+        self.load_seconds = None
+        self._model = None
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = f"{model_fingerprint(self.model_path)}:{self.name}"
+        return self._fingerprint
+
+    def load(self):
+        if self._model is None:
+            start = time.time()
+            print(f"Loading sentence-transformer model from: {self.model_path}")
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_path)
+            self.load_seconds = time.time() - start
+            print(f"Model loaded successfully in {self.load_seconds:.2f} seconds.")
+        return self._model
+
+    def encode(self, texts, batch_size=MAX_BATCH_SIZE):
+        model = self.load()
+        return encode_in_buckets(lambda batch: model.encode(batch, batch_size=len(batch)), texts, batch_size)
+
+
+class OnnxEncoder:
+    """An exported (optionally int8) ONNX copy of the model, run with onnxruntime."""
+
+    name = "onnx"
+
+    def __init__(self, onnx_path=DEFAULT_ONNX_PATH, threads=None):
+        self.onnx_path = os.path.abspath(onnx_path)
+        self.threads = threads
+        self.load_seconds = None
+        self._session = None
+        self._tokenizer = None
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = f"{model_fingerprint(self.onnx_path)}:{self.name}"
+        return self._fingerprint
+
+    def load(self):
+        if self._session is None:
+            start = time.time()
+            config_path = os.path.join(self.onnx_path, "encoder_config.json")
+            if not os.path.exists(config_path):
+                raise FileNotFoundError(f"No ONNX export at '{self.onnx_path}'. Run: python src/encoders.py export")
+            with open(config_path) as f:
+                config = json.load(f)
+            print(f"Loading ONNX encoder from: {self.onnx_path} ({'int8' if config['quantized'] else 'fp32'})")
+
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+            tokenizer = Tokenizer.from_file(os.path.join(self.onnx_path, "tokenizer.json"))
+            tokenizer.enable_truncation(max_length=config["max_seq_length"])
+            tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self.threads:
+                options.intra_op_num_threads = self.threads
+            self._session = ort.InferenceSession(os.path.join(self.onnx_path, config["model_file"]), options, providers=["CPUExecutionProvider"])
+            self._input_names = {i.name for i in self._session.get_inputs()}
+            self._tokenizer = tokenizer
+            self.load_seconds = time.time() - start
+            print(f"Model loaded successfully in {self.load_seconds:.2f} seconds.")
+        return self._session
+
+    def _encode_batch(self, texts):
+        encodings = self._tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feed["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        token_embeddings = self._session.run(None, feed)[0]
+        # Mean pooling over real tokens, then L2 normalization (the model's Pooling + Normalize modules)
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def encode(self, texts, batch_size=MAX_BATCH_SIZE):
+        self.load()
+        return encode_in_buckets(self._encode_batch, texts, batch_size)
+
+
+def get_encoder(backend="torch", model_path=DEFAULT_MODEL_PATH, onnx_path=DEFAULT_ONNX_PATH):
+    """Returns an unloaded encoder for the named backend."""
+    if backend == "torch":
+        return SentenceTransformerEncoder(model_path)
+    if backend == "onnx":
+        return OnnxEncoder(onnx_path)
+    raise ValueError(f"Unknown encoder backend '{backend}'. Choose from: torch, onnx")
+
+
+# --- Export and parity tooling ---
+def export_onnx(model_path=DEFAULT_MODEL_PATH, output_path=DEFAULT_ONNX_PATH, quantize=True):
+    """Exports the transformer to ONNX and, by default, quantizes its weights to int8."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output_path, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModel.from_pretrained(model_path).eval()
+    sample = tokenizer(["An expert needs the most relevant sections."], return_tensors="pt")
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    class _Transformer(torch.nn.Module):
+        # Pins the positional input order, which BertModel.forward does not guarantee across versions
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.inner(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids).last_hidden_state
+
+    fp32_file = os.path.join(output_path, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(_Transformer(model), tuple(sample[n] for n in names), fp32_file, input_names=names,
+                          output_names=["last_hidden_state"], dynamic_axes=dynamic_axes, opset_version=14, dynamo=False)
+    model_file = "model.onnx"
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_file, os.path.join(output_path, "model_int8.onnx"), weight_type=QuantType.QInt8)
+        os.remove(fp32_file)
+        model_file = "model_int8.onnx"
+
+    shutil.copy(os.path.join(model_path, "tokenizer.json"), os.path.join(output_path, "tokenizer.json"))
+    with open(os.path.join(output_path, "encoder_config.json"), "w") as f:
+        json.dump({"model_file": model_file, "quantized": quantize, "max_seq_length": MAX_SEQ_LENGTH,
+                   "source_fingerprint": model_fingerprint(model_path)}, f, indent=2)
+    print(f"Exported {'int8' if quantize else 'fp32'} ONNX encoder to {output_path}")
+    return output_path
+
+
+def measure(encoder, texts, batch_size=BATCH_SIZE):
+    """Returns (embeddings, startup seconds, per-batch latencies in ms)."""
+    start = time.time()
+    encoder.load()
+    startup = time.time() - start
+    latencies, batches = [], []
+    for i in range(0, len(texts), batch_size):
+        t = time.perf_counter()
+        batches.append(encoder.encode(texts[i:i + batch_size], batch_size=batch_size))
+        latencies.append((time.perf_counter() - t) * 1000)
+    return np.vstack(batches), startup, latencies
+
+
+def check_parity(reference, candidate, texts, batch_size=BATCH_SIZE, top_k=5):
+    """
+    Compares two encoders on the same texts: embedding cosine agreement, whether the
+    top-k texts retrieved for each text match, and start-up and per-batch latency.
+    """
+    ref, ref_start, ref_lat = measure(reference, texts, batch_size)
+    cand, cand_start, cand_lat = measure(candidate, texts, batch_size)
+    cosine = np.sum(ref * cand, axis=1) / (np.linalg.norm(ref, axis=1) * np.linalg.norm(cand, axis=1))
+    k = min(top_k, len(texts))
+    ref_top = np.argsort(-(ref @ ref.T), axis=1)[:, :k]
+    cand_top = np.argsort(-(cand @ cand.T), axis=1)[:, :k]
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_top, cand_top)])
+    return {
+        "texts": len(texts),
+        "cosine_min": round(float(cosine.min()), 5),
+        "cosine_mean": round(float(cosine.mean()), 5),
+        f"top{k}_overlap": round(float(overlap), 4),
+        reference.name: {"startup_s": round(ref_start, 3), "batch_ms_mean": round(float(np.mean(ref_lat)), 2)},
+        candidate.name: {"startup_s": round(cand_start, 3), "batch_ms_mean": round(float(np.mean(cand_lat)), 2)},
+    }
+
+
+def sample_texts(input_dir="app/input", limit=512):
+    """Collects section titles and text lines from the input collections' PDFs as parity samples."""
+    import fitz  # PyMuPDF
+    texts = []
+    for root, _, files in sorted(os.walk(input_dir)):
+        for name in sorted(files):
+            if not name.lower().endswith(".pdf"):
+                continue
+            with fitz.open(os.path.join(root, name)) as doc:
+                for page in doc:
+                    texts.extend(line.strip() for line in page.get_text("text").split("\n") if len(line.strip()) > 3)
+            if len(texts) >= limit:
+                return texts[:limit]
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the ONNX encoder backend and check it against PyTorch.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="export the model to ONNX")
+    export.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    export.add_argument("--output", default=DEFAULT_ONNX_PATH)
+    export.add_argument("--no-quantize", action="store_true", help="keep fp32 weights")
+    parity = sub.add_parser("parity", help="compare ONNX embeddings and latency against PyTorch")
+    parity.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    parity.add_argument("--onnx", default=DEFAULT_ONNX_PATH)
+    parity.add_argument("--input", default="app/input", help="directory of PDFs to sample texts from")
+    parity.add_argument("--limit", type=int, default=512)
+    parity.add_argument("--min-cosine", type=float, default=0.98, help="fail if any embedding agrees less than this")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.model, args.output, quantize=not args.no_quantize)
+        return 0
+    texts = sample_texts(args.input, args.limit)
+    report = check_parity(SentenceTransformerEncoder(args.model), OnnxEncoder(args.onnx), texts)
+    print(json.dumps(report, indent=2))
+    return 0 if report["cosine_min"] >= args.min_cosine else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,95 @@
+"""
+Lexical scoring and keyword matching for the 1B ranker.
+
+An inverted index over section titles and text gives BM25 scores for a query
+without touching the model, and exclusion/boost keyword lists are compiled into
+a single regular expression each. In candidate-pruning mode only the top-N
+lexical candidates of each query (after exclusions) are dense-encoded.
+"""
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+from vector_index import top_k
+
+TOKEN_PATTERN = re.compile(r'\w+')
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def keyword_matcher(keywords):
+    """
+    Compiles keywords into one regex that matches wherever any keyword occurs as a
+    substring (the same test as `any(k in text for k in keywords)`); None for no keywords.
+    """
+    keywords = sorted(set(keywords), key=len, reverse=True)
+    if not keywords:
+        return None
+    return re.compile("|".join(re.escape(k) for k in keywords))
+
+
+def matches(matcher, texts):
+    """Boolean array: which (already lower-cased) texts contain any of the matcher's keywords."""
+    if matcher is None:
+        return np.zeros(len(texts), dtype=bool)
+    search = matcher.search
+    return np.fromiter((search(text) is not None for text in texts), dtype=bool, count=len(texts))
+
+
+class InvertedIndex:
+    """Term -> (section ids, term frequencies) postings over section title + text, scored with BM25."""
+
+    def __init__(self, texts):
+        postings = {}
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for i, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[i] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(i)
+                postings[term][1].append(tf)
+        self.size = len(texts)
+        self.lengths = lengths
+        self.avg_length = float(lengths.mean()) if len(texts) and lengths.mean() > 0 else 1.0
+        self.postings = {term: (np.array(ids, dtype=np.int64), np.array(tfs, dtype=np.float32))
+                         for term, (ids, tfs) in postings.items()}
+
+    def bm25(self, query, k1=BM25_K1, b=BM25_B):
+        """BM25 score of every section for the query text."""
+        scores = np.zeros(self.size, dtype=np.float32)
+        norm = k1 * (1 - b + b * self.lengths / self.avg_length)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            ids, tfs = posting
+            idf = math.log(1 + (self.size - len(ids) + 0.5) / (len(ids) + 0.5))
+            scores[ids] += idf * tfs * (k1 + 1) / (tfs + norm[ids])
+        return scores
+
+
+class LexicalCorpus:
+    """A collection's parsed sections (without embeddings) plus their lexical index."""
+
+    def __init__(self, sections, documents):
+        self.sections = sections
+        self.documents = documents  # PDF file names, in corpus order
+        self.texts_lower = [(sec['section_title'] + ' ' + sec['text']).lower() for sec in sections]
+        self.index = InvertedIndex(self.texts_lower)
+
+    def __len__(self):
+        return len(self.sections)
+
+    def candidates(self, query, n, excluded=None):
+        """Indices of the n best BM25 matches for the query, best first, never returning excluded sections."""
+        scores = self.index.bm25(query)
+        if excluded is not None:
+            scores[excluded] = -np.inf
+        return top_k(scores, n)[0]
@@ -1,96 +1,99 @@
-import fitz  # PyMuPDF
+import argparse
 import json
 import time
 import os
 import statistics
 import re
-from collections import defaultdict
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import profiling
+from embedding_cache import EmbeddingCache
+from encoders import CHARS_PER_TOKEN, DEFAULT_MODEL_PATH, DEFAULT_ONNX_PATH, MAX_BATCH_SIZE, encode_groups, get_encoder
+from parse_store import ParseStore, file_digest
+from parsing import PARSE_WORKERS, PARSER_VERSION, iter_parsed_documents, parse_documents
+from lexical import LexicalCorpus, keyword_matcher, matches
+from streaming import RunningTopK, iter_section_chunks
+from vector_index import INDEX_DTYPES, VectorIndex, corpus_manifest, top_k
 
-# --- 1. Load the pre-trained model from a local directory ---
-MODEL_PATH = './models/all-MiniLM-L6-v2'
-print(f"Loading sentence-transformer model from: {MODEL_PATH}")
-MODEL = SentenceTransformer(MODEL_PATH)
-print("Model loaded successfully.")
+# --- 1. Select the encoder; the model itself is loaded lazily on first encode ---
+MODEL_PATH, ONNX_MODEL_PATH = DEFAULT_MODEL_PATH, DEFAULT_ONNX_PATH
+ENCODER_BACKEND = os.environ.get("ENCODER_BACKEND", "torch")
 
-# --- Final Parser with Intelligent Section Merging ---
-def parse_documents(doc_paths):
-    all_sections = []
-    INSTRUCTION_VERBS = {'mix', 'combine', 'add', 'serve', 'preheat', 'cook', 'sauté', 'stir', 'bake', 'roast', 'garnish', 'drain', 'rinse', 'set', 'layer', 'top', 'spread', 'roll', 'place'}
+# --- 2. Persistent embedding cache (set EMBEDDING_CACHE_DIR="" to disable) ---
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", "./cache/embeddings")
+EMBEDDING_CACHE_MAX_MB = int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "512"))
 
-    for doc_path in doc_paths:
-        doc_name = os.path.basename(doc_path)
-        try:
-            doc = fitz.open(doc_path)
-        except Exception as e:
-            print(f"--> [Warning] Could not open or read '{doc_name}'. Skipping. Error: {e}")
-            continue
+# --- 3. Persistent per-corpus vector index (set VECTOR_INDEX_DIR="" to always rebuild in memory) ---
+VECTOR_INDEX_DIR = os.environ.get("VECTOR_INDEX_DIR", "./cache/index")
+VECTOR_INDEX_DTYPE = os.environ.get("VECTOR_INDEX_DTYPE", "float32")
+if VECTOR_INDEX_DTYPE not in INDEX_DTYPES:
+    raise ValueError(f"VECTOR_INDEX_DTYPE must be one of {INDEX_DTYPES}, got '{VECTOR_INDEX_DTYPE}'")
+
+# --- 4. Persistent per-document parse store (set PARSE_CACHE_DIR="" to always re-parse) ---
+PARSE_CACHE_DIR = os.environ.get("PARSE_CACHE_DIR", "./cache/parsed")
+PARSE_STORE = None
+
+# --- 5. Lexical candidate pruning: only the top-N BM25 sections per query are dense-encoded (0 = encode everything) ---
+LEXICAL_CANDIDATES = int(os.environ.get("LEXICAL_CANDIDATES", "0"))
+
+# --- 6. Bounded-memory streaming: embed and rank this many sections at a time, keeping only each query's top-k (0 = off) ---
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", "0"))
+
+# --- 7. Without parse workers, sections of several PDFs are encoded together once this many are pending ---
+ENCODE_FLUSH_SECTIONS = 8 * MAX_BATCH_SIZE
+
+MODEL = None
+EMBEDDING_CACHE = None
+
+def set_encoder(backend):
+    """Selects the encoder backend ("torch" or "onnx") and the embedding cache that goes with it."""
+    global MODEL, EMBEDDING_CACHE
+    MODEL = get_encoder(backend, MODEL_PATH, ONNX_MODEL_PATH)
+    EMBEDDING_CACHE = None
+    if EMBEDDING_CACHE_DIR:
+        # The fingerprint includes the backend, so int8 and fp32 embeddings never mix
+        EMBEDDING_CACHE = EmbeddingCache(EMBEDDING_CACHE_DIR, MODEL.fingerprint, EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+
+def init_runtime(backend=None):
+    """
+    Creates the encoder, its embedding cache and the parse store on first call (and a new
+    encoder when another backend is asked for). Not done at import time: spawned parse
+    workers re-import this module as __mp_main__ and must not open the caches again.
+    """
+    global PARSE_STORE, VECTOR_INDEX_DIR
+    if VECTOR_INDEX_DIR:
+        # Resolved once, like the other cache directories, so a later chdir cannot move it
+        VECTOR_INDEX_DIR = os.path.abspath(VECTOR_INDEX_DIR)
+    if MODEL is None or (backend and backend != MODEL.name):
+        set_encoder(backend or ENCODER_BACKEND)
+    if PARSE_STORE is None and PARSE_CACHE_DIR:
+        PARSE_STORE = ParseStore(PARSE_CACHE_DIR, PARSER_VERSION)
+
+def cosine_similarity(a, b):
+    """sklearn's cosine_similarity, imported on first use to keep start-up fast."""
+    from sklearn.metrics.pairwise import cosine_similarity as _cosine_similarity
+    return _cosine_similarity(a, b)
 
-        print(f"Analyzing layout for: {doc_name}")
-        style_counts = defaultdict(int)
-        for page in doc:
-            for b in page.get_text("dict")["blocks"]:
-                if b['type'] == 0:
-                    for l in b['lines']:
-                        for s in l['spans']:
-                            style = (round(s['size']), s['font'])
-                            style_counts[style] += len(s['text'].strip())
-        
-        if not style_counts: continue
-        body_style = max(style_counts, key=style_counts.get)
-        
-        # --- NEW LOGIC: Process document as a continuous stream ---
-        current_text = ""
-        current_title = f"{doc_name} - Introduction" # A default for the very first section if no header is found
-        start_page = 1
-
-        for page_num, page in enumerate(doc):
-            blocks = page.get_text("dict")["blocks"]
-            for b in blocks:
-                if b['type'] == 0:
-                    for l in b['lines']:
-                        if not l['spans']: continue
-                        line_text = "".join(s['text'] for s in l['spans']).strip()
-                        if not line_text: continue
-                        
-                        span = l['spans'][0]
-                        line_style = (round(span['size']), span['font'])
-                        
-                        is_stylistically_different = (line_style != body_style)
-                        first_word = line_text.split(' ')[0].lower()
-                        is_instruction = first_word in INSTRUCTION_VERBS
-                        is_list_item = re.match(r'^\s*([o•*✓-]|[a-zA-Z0-9][.)])\s+', line_text)
-                        is_ingredient = re.match(r'^\s*([0-9½¼¾⅓⅔⅛⅜⅝⅞]|one|two|three)\s+', line_text.lower())
-                        has_enough_words = len(line_text.split()) > 1
-                        
-                        # Check if the line is a header
-                        if is_stylistically_different and has_enough_words and not is_instruction and not is_list_item and not is_ingredient:
-                            # If a header is found, save the previous section...
-                            if current_text.strip():
-                                all_sections.append({"document": doc_name, "page_number": start_page, "section_title": current_title, "text": current_text.strip()})
-                            
-                            # ...and start a new one.
-                            current_title = line_text.replace('\n', ' ').strip()
-                            current_text = ""
-                            start_page = page_num + 1
-                        else:
-                            # If not a header, it's body text. Append it to the current section.
-                            current_text += line_text + "\n"
-        
-        # Add the very last section being built
-        if current_text.strip():
-            all_sections.append({"document": doc_name, "page_number": start_page, "section_title": current_title, "text": current_text.strip()})
-    
-    return all_sections
-
-def get_refined_text(section_text, query_embedding, num_sentences=5):
+def encode(texts):
+    """Encodes texts, reusing embeddings from the on-disk cache when it is enabled."""
+    if EMBEDDING_CACHE is None:
+        return MODEL.encode(texts)
+    return EMBEDDING_CACHE.encode(texts, MODEL.encode)
+
+def split_sentences(section_text):
     sentences = []
     for line in section_text.split('\n'):
         sentences.extend(s.strip() for s in line.split('.') if s.strip())
+    return sentences
+
+def get_refined_text(section_text, query_embedding, num_sentences=5, sentence_embeddings=None):
+    sentences = split_sentences(section_text)
     if not sentences: return section_text.replace('\n', ' ').strip()[:1000]
-    sentence_embeddings = MODEL.encode(sentences)
+    if sentence_embeddings is None:
+        sentence_embeddings = encode(sentences)
     similarities = cosine_similarity(query_embedding, sentence_embeddings)[0]
     top_indices = np.argsort(similarities)[-num_sentences:][::-1]
     top_indices.sort()
@@ -100,97 +103,548 @@ def get_refined_text(section_text, query_embedding, num_sentences=5):
 def clean_text(text):
     return text.replace('\u00e9', 'e') # remove 'é'
 
-def process_collection(collection_dir):
-    start_time = time.time()
+# --- Ranking settings ---
+CONTENT_WEIGHT, TITLE_WEIGHT, FILENAME_BOOST = 0.75, 0.25, 0.1
+TOP_K_SECTIONS = 20
+TOP_N_REFINED = 5
+EXCLUSION_FILTERS = [
+    (("vegetarian", "vegan"), "vegetarian/vegan", ['beef', 'chicken', 'turkey', 'pork', 'fish', 'lamb', 'sausage', 'bacon', 'tuna', 'salmon', 'ham', 'shrimp', 'crab', 'lobster', 'meatball', 'mince']),
+    (("gluten-free",), "gluten-free", ['wheat', 'flour', 'bread', 'pasta', 'noodle', 'barley', 'rye', 'couscous', 'semolina', 'tortilla', 'croutons']),
+]
+
+def list_pdfs(pdfs_dir):
+    return [os.path.join(pdfs_dir, f) for f in os.listdir(pdfs_dir) if f.lower().endswith(".pdf")]
+
+def embed_documents(doc_paths):
+    """
+    Parses and embeds every PDF. Returns, per path, (sections, content_embeddings, title_embeddings),
+    or None for PDFs without extractable text.
+    """
+    # Parsing starts in worker processes right away; the model is loaded meanwhile
+    parsed_documents = iter_parsed_documents(doc_paths, store=PARSE_STORE)
+    print("Generating embeddings...")
+    MODEL.load()
+    embedded = [None for _ in doc_paths]
+    # With parse workers, each document is encoded as soon as it is parsed, overlapping with
+    # parsing of the rest. Parsing in-process leaves nothing to overlap, so documents are
+    # pooled into fewer, fuller model batches instead.
+    flush_at = 1 if PARSE_WORKERS > 1 else ENCODE_FLUSH_SECTIONS
+    pending = []
+
+    def flush():
+        sections = [sec for _, doc_sections in pending for sec in doc_sections]
+        content_embeddings, title_embeddings = encode_groups(encode, [sec["text"] for sec in sections], [sec["section_title"] for sec in sections])
+        start = 0
+        for i, doc_sections in pending:
+            end = start + len(doc_sections)
+            embedded[i] = (doc_sections, content_embeddings[start:end], title_embeddings[start:end])
+            start = end
+        pending.clear()
+
+    pending_sections = 0
+    for i, sections in parsed_documents:
+        if sections:
+            profiling.count(sections[0]["document"], est_tokens=sum(len(sec["text"]) + len(sec["section_title"]) for sec in sections) // CHARS_PER_TOKEN)
+            pending.append((i, sections))
+            pending_sections += len(sections)
+            if pending_sections >= flush_at:
+                flush()
+                pending_sections = 0
+    if pending:
+        flush()
+    return embedded
+
+def assemble_index(doc_paths, embedded):
+    """Builds a VectorIndex from per-document embeddings, naming each section after its path (None if no text was found)."""
+    parts = [(os.path.basename(path), e) for path, e in zip(doc_paths, embedded) if e is not None]
+    if not parts:
+        return None
+    # The same PDF may be filed under different names in different collections
+    all_sections = [dict(sec, document=name) for name, (sections, _, _) in parts for sec in sections]
+    content_embeddings = np.vstack([e[1] for _, e in parts])
+    title_embeddings = np.vstack([e[2] for _, e in parts])
+    return VectorIndex(all_sections, [os.path.basename(p) for p in doc_paths], content_embeddings, title_embeddings)
+
+def build_index(doc_paths):
+    """Parses and embeds every PDF, returning a VectorIndex (None if no text was found)."""
+    return assemble_index(doc_paths, embed_documents(doc_paths))
+
+def parse_corpus(doc_paths):
+    """Parses every PDF without embedding it; returns each path's sections."""
+    parsed = [[] for _ in doc_paths]
+    for i, sections in iter_parsed_documents(doc_paths, store=PARSE_STORE):
+        parsed[i] = sections
+    return parsed
+
+def lexical_corpus(doc_paths, parsed):
+    """Builds a LexicalCorpus from per-document sections, naming each section after its path (None if no text was found)."""
+    all_sections = [dict(sec, document=os.path.basename(path)) for path, sections in zip(doc_paths, parsed) for sec in sections]
+    if not all_sections:
+        return None
+    return LexicalCorpus(all_sections, [os.path.basename(p) for p in doc_paths])
+
+def index_model_id():
+    """Identifies what a stored index was built with: the encoder and the parser version."""
+    return f"{MODEL.fingerprint}:parser-{PARSER_VERSION}"
+
+def index_dir_for(pdfs_dir):
+    corpus_name = os.path.basename(os.path.dirname(os.path.abspath(pdfs_dir)))
+    corpus_key = hashlib.sha1(os.path.abspath(pdfs_dir).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(VECTOR_INDEX_DIR, f"{corpus_name}-{corpus_key}")
+
+# Indexes already loaded by this process, so long-running callers skip even the disk read
+LOADED_INDEXES_MAX = int(os.environ.get("LOADED_INDEXES_MAX", "8"))
+_LOADED_INDEXES = OrderedDict()  # abspath of PDFs folder -> (model id, manifest, index), least recently used first
+_INDEX_LOCKS = {}
+_INDEX_LOCKS_GUARD = threading.Lock()
+
+def load_corpus_index(pdfs_dir):
+    """Returns the vector index for a PDFs folder, reusing the one on disk while the PDFs and model are unchanged."""
+    key = os.path.abspath(pdfs_dir)
+    with _INDEX_LOCKS_GUARD:
+        lock = _INDEX_LOCKS.setdefault(key, threading.Lock())
+    # Concurrent callers for the same corpus wait for one build instead of racing to write it
+    with lock:
+        doc_paths = list_pdfs(pdfs_dir)
+        manifest = corpus_manifest(doc_paths)
+        with _INDEX_LOCKS_GUARD:
+            loaded = _LOADED_INDEXES.get(key)
+            if loaded is not None:
+                _LOADED_INDEXES.move_to_end(key)
+        if loaded is not None and loaded[:2] == (MODEL.fingerprint, manifest):
+            return loaded[2]
+        index = _load_or_build_index(pdfs_dir, doc_paths, manifest)
+        if index is not None:
+            with _INDEX_LOCKS_GUARD:
+                _LOADED_INDEXES[key] = (MODEL.fingerprint, manifest, index)
+                _LOADED_INDEXES.move_to_end(key)
+                while len(_LOADED_INDEXES) > LOADED_INDEXES_MAX:
+                    _LOADED_INDEXES.popitem(last=False)
+        return index
+
+def _load_or_build_index(pdfs_dir, doc_paths, manifest):
+    if not VECTOR_INDEX_DIR:
+        return build_index(doc_paths)
+    index_dir = index_dir_for(pdfs_dir)
+    index = VectorIndex.load(index_dir, index_model_id(), manifest)
+    if index is not None:
+        print(f"Loaded vector index with {len(index)} sections from '{index_dir}'")
+        return index
+    index = build_index(doc_paths)
+    if index is not None:
+        index.save(index_dir, index_model_id(), manifest, VECTOR_INDEX_DTYPE)
+        print(f"Saved vector index with {len(index)} sections to '{index_dir}'")
+    return index
+
+def contextual_query(input_data):
+    persona = input_data["persona"]["role"]
+    job_to_be_done = input_data["job_to_be_done"]["task"]
+    return (f"An expert {persona} needs to accomplish the following task: {job_to_be_done}. To do this, they are looking for the most relevant sections...")
+
+def exclusion_keywords_for(job_to_be_done):
+    job_lower = job_to_be_done.lower()
+    exclusion_keywords = []
+    for triggers, label, keywords in EXCLUSION_FILTERS:
+        if any(trigger in job_lower for trigger in triggers):
+            print(f"Applying {label} exclusion filter...")
+            exclusion_keywords.extend(keywords)
+    return exclusion_keywords
+
+def rank_queries(index, queries, top_k_sections=TOP_K_SECTIONS, top_n_sections=TOP_N_REFINED, exclusions=None, allowed=None):
+    """
+    Ranks the indexed sections for a batch of persona/job queries (dicts shaped like
+    challenge1b_input.json) and returns one challenge1b_output-style dict per query.
+    `exclusions` (from query_exclusions) and `allowed` are optional per-query section
+    masks; sections that are excluded or not allowed are never ranked.
+    """
+    query_embeddings = encode_queries(queries)
+    with profiling.stage("similarity", queries=len(queries), sections=len(index)):
+        scores = index.scores(query_embeddings, CONTENT_WEIGHT, TITLE_WEIGHT)
+    with profiling.stage("filtering", queries=len(queries)):
+        if exclusions is None:
+            exclusions = query_exclusions(index, queries)
+        apply_boosts_and_exclusions(index, queries, scores, exclusions)
+        if allowed is not None:
+            for qi, mask in enumerate(allowed):
+                scores[qi][~mask] = -np.inf
+    with profiling.stage("top_k", queries=len(queries)):
+        rankings = top_k(scores, max(top_k_sections, top_n_sections))
+
+    with profiling.stage("refinement", queries=len(queries)):
+        return build_outputs(index.sections, index.documents, queries, query_embeddings, rankings, top_k_sections, top_n_sections)
+
+def encode_queries(queries):
+    query_texts = [contextual_query(q) for q in queries]
+    for text in query_texts:
+        print(f"Generated Contextual Query: {text}")
+    print("Ranking...")
+    with profiling.stage("query_encoding", queries=len(queries)):
+        return encode(query_texts)
+
+def exclusion_matchers(queries):
+    """Per query, its compiled exclusion keywords (None when no filter applies)."""
+    return [keyword_matcher(exclusion_keywords_for(q["job_to_be_done"]["task"])) for q in queries]
+
+def query_exclusions(corpus, queries, matchers=None):
+    """Per query, a mask of the sections its exclusion filters remove (None when no filter applies)."""
+    if matchers is None:
+        matchers = exclusion_matchers(queries)
+    return [None if matcher is None else matches(matcher, corpus.texts_lower) for matcher in matchers]
+
+def apply_boosts_and_exclusions(index, queries, scores, exclusions):
+    """Adds each query's filename boost to its scores and sets excluded sections to -inf, in place."""
+    documents_lower = [d.lower() for d in index.documents]
+    for qi, q in enumerate(queries):
+        job_keywords = set(re.findall(r'\w+', q["job_to_be_done"]["task"].lower()))
+        boosted = matches(keyword_matcher(job_keywords), documents_lower)
+        doc_boost = np.where(boosted, FILENAME_BOOST, 0).astype(scores.dtype)
+        scores[qi] += doc_boost[index.doc_ids]
+        if exclusions[qi] is not None:
+            scores[qi][exclusions[qi]] = -np.inf
+
+def rank_queries_pruned(corpus, queries, candidates=None, top_k_sections=TOP_K_SECTIONS, top_n_sections=TOP_N_REFINED):
+    """
+    Candidate-pruning version of rank_queries for a LexicalCorpus: excluded sections are
+    dropped first, then only each query's top `candidates` BM25 matches are dense-encoded
+    and ranked, so encoder cost grows with the candidate count rather than the corpus.
+    """
+    candidates = candidates or LEXICAL_CANDIDATES
+    if candidates < top_k_sections:
+        # Fewer candidates could not fill the top-k list of the output
+        print(f"--> [Warning] Raising lexical candidates from {candidates} to {top_k_sections}, the number of sections ranked per query.")
+        candidates = top_k_sections
+    with profiling.stage("filtering", queries=len(queries)):
+        exclusions = query_exclusions(corpus, queries)
+    with profiling.stage("lexical_prefilter", queries=len(queries), sections=len(corpus)):
+        lexical_queries = [f"{q['persona']['role']} {q['job_to_be_done']['task']}" for q in queries]
+        per_query = [corpus.candidates(text, candidates, excluded) for text, excluded in zip(lexical_queries, exclusions)]
+        selected = np.unique(np.concatenate(per_query)) if per_query else np.empty(0, dtype=np.int64)
+    print(f"Lexical prefilter: encoding {len(selected)} of {len(corpus)} sections.")
+    if not len(selected):
+        return build_outputs([], corpus.documents, queries, [None] * len(queries), [[] for _ in queries], top_k_sections, top_n_sections)
+    sections = [corpus.sections[i] for i in selected]
+    with profiling.stage("candidate_encoding", sections=len(sections)):
+        content_embeddings, title_embeddings = encode_groups(encode, [sec["text"] for sec in sections], [sec["section_title"] for sec in sections])
+    index = VectorIndex(sections, corpus.documents, content_embeddings, title_embeddings)
+    allowed = [np.isin(selected, ids) for ids in per_query]
+    return rank_queries(index, queries, top_k_sections, top_n_sections,
+                        exclusions=[None for _ in queries], allowed=allowed)
+
+def rank_queries_streaming(doc_paths, queries, chunk_size=None, top_k_sections=TOP_K_SECTIONS, top_n_sections=TOP_N_REFINED):
+    """
+    Bounded-memory version of rank_queries that works straight from the PDFs: sections are
+    embedded and scored `chunk_size` at a time, and only each query's running top-k (with
+    the full text of those sections) outlives its chunk, so peak memory stays flat however
+    large the collection is. Returns (outputs, sections ranked); outputs is None without text.
+    """
+    chunk_size = chunk_size or STREAM_CHUNK_SIZE
+    documents = [os.path.basename(p) for p in doc_paths]
+    query_embeddings = encode_queries(queries)
+    matchers = exclusion_matchers(queries)
+    running = [RunningTopK(max(top_k_sections, top_n_sections)) for _ in queries]
+    total = 0
+    for start, sections in iter_section_chunks(doc_paths, chunk_size, store=PARSE_STORE):
+        with profiling.stage("chunk_encoding", sections=len(sections)):
+            content_embeddings, title_embeddings = encode_groups(encode, [sec["text"] for sec in sections], [sec["section_title"] for sec in sections])
+        chunk = VectorIndex(sections, documents, content_embeddings, title_embeddings, VECTOR_INDEX_DTYPE)
+        with profiling.stage("similarity", queries=len(queries), sections=len(chunk)):
+            scores = chunk.scores(query_embeddings, CONTENT_WEIGHT, TITLE_WEIGHT)
+        with profiling.stage("filtering", queries=len(queries)):
+            apply_boosts_and_exclusions(chunk, queries, scores, query_exclusions(chunk, queries, matchers))
+        with profiling.stage("top_k", queries=len(queries)):
+            for qi, kept in enumerate(running):
+                kept.push_chunk(scores[qi], start, sections)
+        total += len(sections)
+    if not total:
+        return None, 0
+    print(f"Streamed {total} sections in chunks of {chunk_size}.")
+
+    # Queries often share top sections; refine each kept section once
+    kept_sections, positions, rankings = [], {}, []
+    for kept in running:
+        ranking = []
+        for position, sec in kept.best():
+            if position not in positions:
+                positions[position] = len(kept_sections)
+                kept_sections.append(sec)
+            ranking.append(positions[position])
+        rankings.append(ranking)
+    with profiling.stage("refinement", queries=len(queries)):
+        return build_outputs(kept_sections, documents, queries, query_embeddings, rankings, top_k_sections, top_n_sections), total
+
+def rank_corpus(corpus, queries):
+    """Ranks a VectorIndex densely, or a LexicalCorpus with lexical candidate pruning."""
+    if isinstance(corpus, LexicalCorpus):
+        return rank_queries_pruned(corpus, queries)
+    return rank_queries(corpus, queries)
+
+def build_outputs(sections, documents, queries, query_embeddings, rankings, top_k_sections, top_n_sections):
+    """Builds each query's output dict from its ranked section indices, refining its top sections to their best sentences."""
+    refined = [[sections[i] for i in ranking[:top_n_sections]] for ranking in rankings]
+    # Encode the sentences of every refined section of every query together
+    sentence_lists = [split_sentences(sec["text"]) for secs in refined for sec in secs]
+    sentence_embeddings = iter(encode_groups(encode, *sentence_lists))
+
+    outputs = []
+    for q, query_embedding, ranking, refined_sections in zip(queries, query_embeddings, rankings, refined):
+        output_data = {
+            "metadata": {"input_documents": documents, "persona": q["persona"], "job_to_be_done": q["job_to_be_done"], "processing_timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())},
+            "extracted_sections": [],
+            "sub_section_analysis": []
+        }
+        for rank, i in enumerate(ranking[:top_k_sections]):
+            sec = sections[i]
+            output_data["extracted_sections"].append({"document": clean_text(sec["document"]), "page_number": sec["page_number"], "section_title": clean_text(sec["section_title"]), "importance_rank": rank + 1})
+        for sec in refined_sections:
+            refined_text = get_refined_text(sec["text"], query_embedding[None, :], sentence_embeddings=next(sentence_embeddings))
+            output_data["sub_section_analysis"].append({"document": clean_text(sec["document"]), "section_title": clean_text(sec["section_title"]), "refined_text": clean_text(refined_text), "page_number": sec["page_number"]})
+        outputs.append(output_data)
+    return outputs
+
+def print_cache_stats():
+    if EMBEDDING_CACHE is not None:
+        EMBEDDING_CACHE.flush()
+        stats = EMBEDDING_CACHE.stats()
+        print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries")
+    if PARSE_STORE is not None:
+        stats = PARSE_STORE.stats()
+        print(f"Parse store: {stats['hits']} PDFs reused, {stats['misses']} parsed, {stats['documents']} stored")
+
+def write_collection_output(collection_dir, outputs, batch_mode=False):
+    """Writes a collection's ranking results under app/output/<collection> and returns the file path."""
+    collection_name = os.path.basename(os.path.normpath(collection_dir))
+    output_dir = os.path.join("app", "output", collection_name)
+    os.makedirs(output_dir, exist_ok=True)
+    output_filename = os.path.join(output_dir, "challenge1b_queries_output.json" if batch_mode else "challenge1b_output.json")
+    with profiling.stage("json_write", document=collection_name), open(output_filename, "w", encoding='utf-8') as f:
+        json.dump(outputs if batch_mode else outputs[0], f, indent=2, ensure_ascii=False)
+    return output_filename
+
+def read_collection_queries(collection_dir, queries=None):
+    """
+    Checks a collection folder and returns its (queries, batch_mode): the given batch of
+    queries, or its own challenge1b_input.json. Returns None if the collection must be skipped.
+    """
     input_json_path = os.path.join(collection_dir, "challenge1b_input.json")
-    if not os.path.exists(input_json_path):
+    if queries is None and not os.path.exists(input_json_path):
         print(f"--> [ERROR] Skipping '{os.path.basename(collection_dir)}'. Reason: 'challenge1b_input.json' file not found.")
-        return
+        return None
     pdfs_dir = os.path.join(collection_dir, "PDFs")
     if not os.path.isdir(pdfs_dir):
         print(f"--> [ERROR] Skipping '{os.path.basename(collection_dir)}'. Reason: 'PDFs' subfolder not found.")
-        return
-
+        return None
+    if queries is not None:
+        return queries, True
     with open(input_json_path, 'r') as f:
-        input_data = json.load(f)
-    
-    persona = input_data["persona"]["role"]
-    job_to_be_done = input_data["job_to_be_done"]["task"]
-    contextual_query = (f"An expert {persona} needs to accomplish the following task: {job_to_be_done}. To do this, they are looking for the most relevant sections...")
-    print(f"Generated Contextual Query: {contextual_query}")
+        return [json.load(f)], False
 
-    doc_paths = [os.path.join(pdfs_dir, f) for f in os.listdir(pdfs_dir) if f.lower().endswith(".pdf")]
-    all_sections = parse_documents(doc_paths)
-    if not all_sections:
+def process_collection(collection_dir, queries=None):
+    """
+    Ranks a collection's PDFs for its challenge1b_input.json, or for a batch of
+    queries when given (written together to challenge1b_queries_output.json).
+    Returns the output file path, or None if the collection was skipped.
+    """
+    start_time = time.time()
+    init_runtime()
+    job = read_collection_queries(collection_dir, queries)
+    if job is None:
+        return
+    queries, batch_mode = job
+
+    rank_start = time.time()
+    if STREAM_CHUNK_SIZE:
+        outputs, _ = rank_queries_streaming(list_pdfs(os.path.join(collection_dir, "PDFs")), queries)
+    else:
+        if LEXICAL_CANDIDATES:
+            doc_paths = list_pdfs(os.path.join(collection_dir, "PDFs"))
+            index = lexical_corpus(doc_paths, parse_corpus(doc_paths))
+        else:
+            index = load_corpus_index(os.path.join(collection_dir, "PDFs"))
+        outputs = rank_corpus(index, queries) if index is not None else None
+    if outputs is None:
         print("--> [Warning] No text could be extracted from any valid PDFs in this collection.")
         return
+    print(f"Ranked {len(queries)} quer{'y' if len(queries) == 1 else 'ies'} in {time.time() - rank_start:.2f} seconds.")
 
-    print("Generating embeddings and ranking...")
-    query_embedding = MODEL.encode([contextual_query])
-    section_texts = [sec["text"] for sec in all_sections]
-    section_titles = [sec["section_title"] for sec in all_sections]
-    content_embeddings = MODEL.encode(section_texts)
-    title_embeddings = MODEL.encode(section_titles)
-    content_similarities = cosine_similarity(query_embedding, content_embeddings)[0]
-    title_similarities = cosine_similarity(query_embedding, title_embeddings)[0]
-    
-    CONTENT_WEIGHT, TITLE_WEIGHT, FILENAME_BOOST = 0.75, 0.25, 0.1
-    job_keywords = set(re.findall(r'\w+', job_to_be_done.lower()))
-    for i, sec in enumerate(all_sections):
-        title_score = title_similarities[i]
-        boost = 0
-        if any(keyword in sec['document'].lower() for keyword in job_keywords):
-            boost = FILENAME_BOOST
-        sec["similarity"] = (CONTENT_WEIGHT * content_similarities[i]) + (TITLE_WEIGHT * title_score) + boost
-
-    ranked_sections = sorted(all_sections, key=lambda x: x["similarity"], reverse=True)
-    
-    job_lower = job_to_be_done.lower()
-    exclusion_keywords = []
-    if "vegetarian" in job_lower or "vegan" in job_lower:
-        print("Applying vegetarian/vegan exclusion filter...")
-        exclusion_keywords.extend(['beef', 'chicken', 'turkey', 'pork', 'fish', 'lamb', 'sausage', 'bacon', 'tuna', 'salmon', 'ham', 'shrimp', 'crab', 'lobster', 'meatball', 'mince'])
-    if "gluten-free" in job_lower:
-        print("Applying gluten-free exclusion filter...")
-        exclusion_keywords.extend(['wheat', 'flour', 'bread', 'pasta', 'noodle', 'barley', 'rye', 'couscous', 'semolina', 'tortilla', 'croutons'])
-    
-    if exclusion_keywords:
-        filtered_sections = []
-        for section in ranked_sections:
-            section_content_lower = (section['section_title'] + ' ' + section['text']).lower()
-            if not any(keyword in section_content_lower for keyword in exclusion_keywords):
-                filtered_sections.append(section)
-        ranked_sections = filtered_sections
-
-    for i, sec in enumerate(ranked_sections):
-        sec["importance_rank"] = i + 1
-
-    output_data = {
-        "metadata": {"input_documents": [os.path.basename(p) for p in doc_paths if os.path.exists(p)], "persona": input_data["persona"], "job_to_be_done": input_data["job_to_be_done"], "processing_timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())},
-        "extracted_sections": [],
-        "sub_section_analysis": []
-    }
-    for sec in ranked_sections[:20]:
-        output_data["extracted_sections"].append({"document": clean_text(sec["document"]), "page_number": sec["page_number"], "section_title": clean_text(sec["section_title"]), "importance_rank": sec["importance_rank"]})
-    top_n_sections = 5
-    for sec in ranked_sections[:top_n_sections]:
-        refined_text = get_refined_text(sec["text"], query_embedding)
-        output_data["sub_section_analysis"].append({"document": clean_text(sec["document"]), "section_title": clean_text(sec["section_title"]), "refined_text": clean_text(refined_text), "page_number": sec["page_number"]})
-
-    collection_name = os.path.basename(collection_dir)
-    output_dir = os.path.join("app", "output", collection_name)
-    os.makedirs(output_dir, exist_ok=True)
-    output_filename = os.path.join(output_dir, "challenge1b_output.json")
-    with open(output_filename, "w", encoding='utf-8') as f:
-        json.dump(output_data, f, indent=2, ensure_ascii=False)
+    output_filename = write_collection_output(collection_dir, outputs, batch_mode)
+    print_cache_stats()
     print(f"\nProcessing complete in {time.time() - start_time:.2f} seconds.")
     print(f"Output saved to {output_filename}")
+    return output_filename
+
+def pdf_digest(path):
+    """Content hash of a PDF, memoized by the parse store when it is enabled."""
+    return PARSE_STORE.digest(path) if PARSE_STORE is not None else file_digest(path)
+
+def process_collections(collection_dirs, queries=None, summary_path=None):
+    """
+    Runs many collections as one batch: reads every input first, parses and embeds each
+    distinct PDF (by content hash) once across all collections, ranks the collections
+    concurrently, then writes each collection's output plus one timing summary.
+    """
+    run_start = time.time()
+    init_runtime()
+    stages = {}
+
+    # --- 1. Read every job up front ---
+    stage_start = time.time()
+    jobs = []
+    for collection_dir in collection_dirs:
+        job = read_collection_queries(collection_dir, queries)
+        if job is None:
+            continue
+        doc_paths = list_pdfs(os.path.join(collection_dir, "PDFs"))
+        jobs.append({"dir": collection_dir, "name": os.path.basename(collection_dir), "queries": job[0], "batch_mode": job[1],
+                     "doc_paths": doc_paths, "manifest": corpus_manifest(doc_paths), "index": None, "index_source": None})
+    stages["read_inputs"] = time.time() - stage_start
+
+    # --- 2. Reuse stored indexes; hash the PDFs of every collection that still needs one ---
+    stage_start = time.time()
+    if VECTOR_INDEX_DIR and not (LEXICAL_CANDIDATES or STREAM_CHUNK_SIZE):
+        for job in jobs:
+            job["index"] = VectorIndex.load(index_dir_for(os.path.join(job["dir"], "PDFs")), index_model_id(), job["manifest"])
+            if job["index"] is not None:
+                job["index_source"] = "stored"
+    if STREAM_CHUNK_SIZE:
+        # Streamed collections are parsed and embedded chunk by chunk while ranking (step 5)
+        for job in jobs:
+            job["index_source"] = "streamed"
+    pending = [job for job in jobs if job["index"] is None and job["index_source"] is None]
+    digests = {path: pdf_digest(path) for job in pending for path in job["doc_paths"]}
+    distinct = {}  # digest -> first path with that content
+    for path, digest in digests.items():
+        distinct.setdefault(digest, path)
+    stages["hash_pdfs"] = time.time() - stage_start
+    print(f"{len(jobs)} collections, {len(jobs) - len(pending)} with stored indexes; {len(digests)} PDFs to index, {len(distinct)} distinct.")
+
+    # --- 3. Parse (and, unless pruning lexically, embed) each distinct PDF once ---
+    stage_start = time.time()
+    prepare = parse_corpus if LEXICAL_CANDIDATES else embed_documents
+    prepared = dict(zip(distinct, prepare(list(distinct.values())))) if distinct else {}
+    stages["parse_embed"] = time.time() - stage_start
+
+    # --- 4. Assemble (and store) each collection's index from the shared documents ---
+    stage_start = time.time()
+    for job in pending:
+        documents = [prepared[digests[p]] for p in job["doc_paths"]]
+        if LEXICAL_CANDIDATES:
+            job["index"], job["index_source"] = lexical_corpus(job["doc_paths"], documents), "lexical"
+            continue
+        job["index"] = assemble_index(job["doc_paths"], documents)
+        job["index_source"] = "built"
+        if job["index"] is not None and VECTOR_INDEX_DIR:
+            job["index"].save(index_dir_for(os.path.join(job["dir"], "PDFs")), index_model_id(), job["manifest"], VECTOR_INDEX_DTYPE)
+    stages["build_indexes"] = time.time() - stage_start
+
+    # --- 5. Rank all collections concurrently ---
+    stage_start = time.time()
+    def rank_job(job):
+        job_start = time.time()
+        # One failing collection must not cost the others their output
+        try:
+            if job["index_source"] == "streamed":
+                job["outputs"], job["sections"] = rank_queries_streaming(job["doc_paths"], job["queries"])
+            else:
+                job["outputs"], job["sections"] = rank_corpus(job["index"], job["queries"]), len(job["index"])
+        except Exception as e:
+            job["outputs"], job["error"] = None, f"{type(e).__name__}: {e}"
+            print(f"--> [ERROR] Ranking failed for '{job['name']}'. Error: {e}")
+        job["rank_seconds"] = time.time() - job_start
+    runnable = [job for job in jobs if job["index"] is not None or job["index_source"] == "streamed"]
+    if runnable:
+        with ThreadPoolExecutor(max_workers=min(len(runnable), os.cpu_count() or 1)) as pool:
+            list(pool.map(rank_job, runnable))
+    for job in jobs:
+        if job.get("outputs") is None and not job.get("error"):
+            print(f"--> [Warning] No text could be extracted from any valid PDFs in '{job['name']}'.")
+    stages["rank"] = time.time() - stage_start
+
+    # --- 6. Write each job's output and the run summary ---
+    stage_start = time.time()
+    for job in jobs:
+        if job.get("outputs") is None:
+            continue
+        try:
+            job["output_file"] = write_collection_output(job["dir"], job["outputs"], job["batch_mode"])
+            print(f"Output saved to {job['output_file']}")
+        except OSError as e:
+            job["error"] = f"{type(e).__name__}: {e}"
+            print(f"--> [ERROR] Could not write the output for '{job['name']}'. Error: {e}")
+    ranked = [job for job in jobs if job.get("output_file")]
+    stages["write"] = time.time() - stage_start
+    print_cache_stats()
+
+    summary = {
+        "collections": len(jobs),
+        "pdfs": sum(len(job["doc_paths"]) for job in jobs),
+        "pdfs_indexed": len(digests),
+        "distinct_pdfs_parsed": len(distinct),
+        "stages": {name: round(seconds, 3) for name, seconds in stages.items()},
+        "total_seconds": round(time.time() - run_start, 3),
+        "jobs": [{
+            "collection": job["name"],
+            "queries": len(job["queries"]),
+            "pdfs": len(job["doc_paths"]),
+            "sections": job.get("sections", 0),
+            "index": job["index_source"] if job.get("outputs") is not None else "empty",
+            "status": "ok" if job.get("output_file") else ("failed" if job.get("error") else "empty"),
+            "error": job.get("error"),
+            "rank_seconds": round(job.get("rank_seconds", 0.0), 3),
+            "output": job.get("output_file"),
+        } for job in jobs],
+        "failed": [job["name"] for job in jobs if job.get("error")],
+    }
+    summary_path = summary_path or os.path.join("app", "output", "_batch_summary.json")
+    os.makedirs(os.path.dirname(summary_path) or ".", exist_ok=True)
+    with open(summary_path, "w", encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    print(f"\nProcessed {len(ranked)}/{len(jobs)} collections in {summary['total_seconds']:.2f} seconds. Summary: {summary_path}")
+    return summary
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rank PDF sections for each collection's persona and job-to-be-done.")
+    parser.add_argument("--backend", choices=["torch", "onnx"], default=ENCODER_BACKEND,
+                        help="encoder runtime; 'onnx' needs an export from 'python src/encoders.py export'")
+    parser.add_argument("--collection", action="append",
+                        help="only process this collection folder under app/input (repeatable)")
+    parser.add_argument("--queries",
+                        help="JSON list of {persona, job_to_be_done} objects to rank in one batch against each collection's PDFs")
+    parser.add_argument("--sequential", action="store_true",
+                        help="process collections one at a time instead of as one shared batch")
+    parser.add_argument("--summary",
+                        help="where to write the batch timing summary (default: app/output/_batch_summary.json)")
+    parser.add_argument("--lexical-candidates", type=int, default=LEXICAL_CANDIDATES, metavar="N",
+                        help=f"dense-encode only each query's top N BM25 sections, dropping excluded ones first (0 = encode all; at least {TOP_K_SECTIONS} are kept)")
+    parser.add_argument("--stream-chunk", type=int, default=STREAM_CHUNK_SIZE, metavar="N",
+                        help="bounded-memory mode: embed and rank N sections at a time, keeping only each query's top-k (0 = off)")
+    parser.add_argument("--profile", metavar="TRACE_JSON",
+                        help="record per-stage wall/CPU time and peak memory, write a Chrome trace here and print a summary table")
+    return parser.parse_args(argv)
 
 def main():
+    args = parse_args()
+    if args.profile:
+        profiling.enable()
+    try:
+        run(args)
+    finally:
+        if args.profile:
+            profiler = profiling.disable()
+            profiler.write_trace(args.profile)
+            print(profiler.format_summary())
+            print(f"Profile trace written to {args.profile}")
+
+def run(args):
+    global LEXICAL_CANDIDATES, STREAM_CHUNK_SIZE
+    LEXICAL_CANDIDATES = args.lexical_candidates
+    STREAM_CHUNK_SIZE = args.stream_chunk
+    init_runtime(args.backend)
     base_input_dir = "app/input"
     print(f"Scanning for collections in '{base_input_dir}'...")
     try:
         collection_dirs = [os.path.join(base_input_dir, d) for d in os.listdir(base_input_dir) if os.path.isdir(os.path.join(base_input_dir, d))]
+        if args.collection:
+            collection_dirs = [d for d in collection_dirs if os.path.basename(d) in args.collection]
     except FileNotFoundError:
         print(f"--> [FATAL] Input directory not found at '{base_input_dir}'. Please create it.")
         return
@@ -198,11 +652,19 @@ def main():
         print("No collections found to process.")
         return
 
+    queries = None
+    if args.queries:
+        with open(args.queries, 'r') as f:
+            queries = json.load(f)
+
     print(f"Found {len(collection_dirs)} collections: {[os.path.basename(d) for d in collection_dirs]}")
-    for collection_path in collection_dirs:
-        print(f"\n--- Starting processing for: {os.path.basename(collection_path)} ---")
-        process_collection(collection_path)
-        print(f"--- Finished processing for: {os.path.basename(collection_path)} ---")
+    if args.sequential:
+        for collection_path in collection_dirs:
+            print(f"\n--- Starting processing for: {os.path.basename(collection_path)} ---")
+            process_collection(collection_path, queries)
+            print(f"--- Finished processing for: {os.path.basename(collection_path)} ---")
+        return
+    process_collections(collection_dirs, queries, args.summary)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,138 @@
+"""
+Persistent store of parsed PDF sections, so reruns only parse new or changed PDFs.
+
+    manifest.json              parser version, a stat memo (path -> size, mtime, sha1)
+                               and the section count of every stored document
+    sections/<sha1>.json.gz    one document's sections as gzipped columns
+                               (page_number, section_title, text)
+
+Documents are keyed by the sha1 of their contents, so a renamed or copied PDF is
+not parsed again, and the whole store is discarded when the parser version
+changes. Files are only re-hashed when their size or modification time changes.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+STORE_VERSION = 1
+
+
+def file_digest(path):
+    """sha1 of a file's contents, so the same PDF is recognised under any name or folder."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ParseStore:
+    """Content-addressed, parser-versioned cache of parse_document results."""
+
+    def __init__(self, store_dir, parser_version):
+        self.store_dir = os.path.abspath(store_dir)
+        self.parser_version = parser_version
+        self.hits = self.misses = 0
+        self.paths = {}      # absolute path -> [size, mtime_ns, sha1]
+        self.documents = {}  # sha1 -> section count
+        self._dirty = False
+        self._lock = threading.RLock()
+        os.makedirs(os.path.join(store_dir, "sections"), exist_ok=True)
+        self._load()
+
+    def _manifest_path(self):
+        return os.path.join(self.store_dir, "manifest.json")
+
+    def _sections_path(self, digest):
+        return os.path.join(self.store_dir, "sections", f"{digest}.json.gz")
+
+    def _load(self):
+        try:
+            with open(self._manifest_path()) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"--> [Warning] Parse store manifest at '{self.store_dir}' is unreadable, starting empty. Error: {e}")
+            return
+        if manifest.get("version") != STORE_VERSION or manifest.get("parser_version") != self.parser_version:
+            print(f"Parser version changed ({manifest.get('parser_version')} -> {self.parser_version}); all PDFs will be re-parsed.")
+            self._dirty = True  # the next flush removes the stale documents
+            return
+        self.paths = manifest.get("paths", {})
+        self.documents = manifest.get("documents", {})
+
+    # --- Public API ---
+    def digest(self, path):
+        """Content hash of a PDF, re-hashing only when its size or modification time changed."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            known = self.paths.get(path)
+            if known is not None and known[:2] == [st.st_size, st.st_mtime_ns]:
+                return known[2]
+        digest = file_digest(path)
+        with self._lock:
+            self.paths[path] = [st.st_size, st.st_mtime_ns, digest]
+            self._dirty = True
+        return digest
+
+    def get(self, digest, doc_name):
+        """Returns the stored sections of a document under the given file name, or None if it was never parsed."""
+        with self._lock:
+            stored = digest in self.documents
+        if stored:
+            try:
+                with gzip.open(self._sections_path(digest), "rt", encoding="utf-8") as f:
+                    columns = json.load(f)
+            except (OSError, ValueError, EOFError):
+                columns = None
+            if columns is not None:
+                with self._lock:
+                    self.hits += 1
+                return [{"document": doc_name, "page_number": page, "section_title": title, "text": text}
+                        for page, title, text in zip(columns["page_number"], columns["section_title"], columns["text"])]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, digest, sections):
+        """Stores a freshly parsed document's sections."""
+        columns = {key: [sec[key] for sec in sections] for key in ("page_number", "section_title", "text")}
+        path = self._sections_path(digest)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump(columns, f, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:  # so a concurrent flush never sees the file without its entry
+            os.replace(tmp_path, path)
+            self.documents[digest] = len(sections)
+            self._dirty = True
+
+    def flush(self):
+        """Forgets PDFs that no longer exist, deletes documents nothing refers to, and writes the manifest."""
+        with self._lock:
+            for path in [p for p in self.paths if not os.path.exists(p)]:
+                del self.paths[path]
+                self._dirty = True
+            referenced = {entry[2] for entry in self.paths.values()}
+            for digest in [d for d in self.documents if d not in referenced]:
+                del self.documents[digest]
+                self._dirty = True
+            if not self._dirty:
+                return
+            sections_dir = os.path.join(self.store_dir, "sections")
+            for name in os.listdir(sections_dir):
+                # In-progress writes (.tmp) belong to documents that are not registered yet
+                if not name.endswith(".tmp") and name.split(".")[0] not in self.documents:
+                    os.remove(os.path.join(sections_dir, name))
+            manifest = {"version": STORE_VERSION, "parser_version": self.parser_version, "paths": self.paths, "documents": self.documents}
+            tmp_path = self._manifest_path() + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self._manifest_path())
+            self._dirty = False
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "documents": len(self.documents)}
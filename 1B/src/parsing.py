@@ -0,0 +1,198 @@
+"""
+PDF section parsing for the 1B ranker.
+
+Documents are split into sections at lines whose (size, font) style differs
+from the document's body style. Parsing can run in a pool of worker processes
+so later documents are parsed while earlier ones are already being encoded.
+"""
+import itertools
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import fitz  # PyMuPDF
+
+import profiling
+
+INSTRUCTION_VERBS = {'mix', 'combine', 'add', 'serve', 'preheat', 'cook', 'sauté', 'stir', 'bake', 'roast', 'garnish', 'drain', 'rinse', 'set', 'layer', 'top', 'spread', 'roll', 'place'}
+LIST_ITEM_PATTERN = re.compile(r'^\s*([o•*✓-]|[a-zA-Z0-9][.)])\s+')
+INGREDIENT_PATTERN = re.compile(r'^\s*([0-9½¼¾⅓⅔⅛⅜⅝⅞]|one|two|three)\s+')
+PARSER_VERSION = 2  # bump whenever parse_document's output changes, to invalidate stored parses
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", "0")) or os.cpu_count() or 1
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def extract_lines(doc):
+    """
+    Reads every page's text dict once and returns a compact line buffer plus style table:
+    parallel lists of line texts, style ids and page numbers, the (size, font) style of
+    each id, the number of characters written in each style, and the text block count.
+    """
+    texts, style_ids, pages = [], [], []
+    styles, style_chars = {}, []  # (size, font) -> id; id -> character count
+    blocks = 0
+
+    for page_num, page in enumerate(doc):
+        for b in page.get_text("dict")["blocks"]:
+            if b['type'] != 0:
+                continue
+            blocks += 1
+            for l in b['lines']:
+                spans = l['spans']
+                for s in spans:
+                    style_id = styles.setdefault((round(s['size']), s['font']), len(styles))
+                    if style_id == len(style_chars):
+                        style_chars.append(0)
+                    style_chars[style_id] += len(s['text'].strip())
+                if not spans: continue
+                line_text = "".join(s['text'] for s in spans).strip()
+                if not line_text: continue
+                texts.append(line_text)
+                style_ids.append(styles[(round(spans[0]['size']), spans[0]['font'])])
+                pages.append(page_num)
+    return texts, style_ids, pages, list(styles), style_chars, blocks
+
+
+def is_header_line(line_text):
+    """Whether a line in a non-body style reads like a heading rather than a step, list item or ingredient."""
+    if len(line_text.split()) <= 1:
+        return False
+    if line_text.split(' ')[0].lower() in INSTRUCTION_VERBS:
+        return False
+    if LIST_ITEM_PATTERN.match(line_text):
+        return False
+    return not INGREDIENT_PATTERN.match(line_text.lower())
+
+
+# --- Final Parser with Intelligent Section Merging ---
+def parse_document(doc_path):
+    """Parses one PDF into a list of {document, page_number, section_title, text} sections."""
+    sections = []
+    doc_name = os.path.basename(doc_path)
+    try:
+        with profiling.stage("open", document=doc_name):
+            doc = fitz.open(doc_path)
+    except Exception as e:
+        print(f"--> [Warning] Could not open or read '{doc_name}'. Skipping. Error: {e}")
+        return sections
+
+    print(f"Analyzing layout for: {doc_name}")
+    with doc, profiling.stage("text_extraction", document=doc_name):
+        texts, style_ids, pages, styles, style_chars, blocks = extract_lines(doc)
+        profiling.count(doc_name, pages=doc.page_count, blocks=blocks, lines=len(texts))
+    if not styles: return sections
+    # The body style is the one with the most characters (first seen wins ties)
+    body_style = max(range(len(styles)), key=style_chars.__getitem__)
+
+    # --- Process document as a continuous stream of lines ---
+    with profiling.stage("section_parsing", document=doc_name):
+        sections = segment_lines(doc_name, texts, style_ids, pages, body_style)
+    profiling.count(doc_name, sections=len(sections))
+    return sections
+
+
+def segment_lines(doc_name, texts, style_ids, pages, body_style):
+    """Splits the line buffer into sections at header lines."""
+    sections = []
+    current_lines = []
+    current_title = f"{doc_name} - Introduction" # A default for the very first section if no header is found
+    start_page = 1
+
+    for line_text, style_id, page_num in zip(texts, style_ids, pages):
+        # Check if the line is a header
+        if style_id != body_style and is_header_line(line_text):
+            # If a header is found, save the previous section...
+            if current_lines:
+                sections.append({"document": doc_name, "page_number": start_page, "section_title": current_title, "text": "\n".join(current_lines)})
+
+            # ...and start a new one.
+            current_title = line_text.replace('\n', ' ').strip()
+            current_lines = []
+            start_page = page_num + 1
+        else:
+            # If not a header, it's body text. Append it to the current section.
+            current_lines.append(line_text)
+
+    # Add the very last section being built
+    if current_lines:
+        sections.append({"document": doc_name, "page_number": start_page, "section_title": current_title, "text": "\n".join(current_lines)})
+    return sections
+
+
+def parse_documents(doc_paths):
+    """Parses every PDF in order and returns all their sections."""
+    all_sections = []
+    for doc_path in doc_paths:
+        all_sections.extend(parse_document(doc_path))
+    return all_sections
+
+
+def get_pool(workers=PARSE_WORKERS):
+    """Returns the shared parsing pool, started on first use and reused across collections."""
+    global _POOL
+    with _POOL_LOCK:  # concurrent service jobs must not each start a pool
+        if _POOL is None:
+            # spawn, not fork: the parent may already hold torch/onnxruntime threads
+            _POOL = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _POOL
+
+
+def parse_document_profiled(doc_path):
+    """parse_document for pool workers while profiling: also returns the worker's recorded stages."""
+    profiling.enable()
+    try:
+        sections = parse_document(doc_path)
+    finally:
+        profile = profiling.disable().export()
+    return sections, profile
+
+
+def iter_parsed_documents(doc_paths, workers=PARSE_WORKERS, store=None):
+    """
+    Starts parsing every document and returns an iterator of (index, sections)
+    in completion order, so callers can work on early documents while later ones
+    are still being parsed. With one worker, documents are parsed lazily in order.
+    With a ParseStore, stored documents are returned first and only new or
+    changed PDFs are parsed (and then stored).
+    """
+    if store is None:
+        return _iter_parse(doc_paths, workers)
+    digests = [store.digest(doc_path) for doc_path in doc_paths]
+    stored, missing = [], []
+    for i, (doc_path, digest) in enumerate(zip(doc_paths, digests)):
+        sections = store.get(digest, os.path.basename(doc_path))
+        if sections is None:
+            missing.append(i)
+        else:
+            stored.append((i, sections))
+    if stored:
+        print(f"Reusing stored sections for {len(stored)} of {len(doc_paths)} PDFs; parsing {len(missing)}.")
+    parsed = _iter_parse([doc_paths[i] for i in missing], workers)
+    return itertools.chain(stored, _store_parsed(parsed, missing, digests, store))
+
+
+def _store_parsed(parsed, missing, digests, store):
+    for j, sections in parsed:
+        store.put(digests[missing[j]], sections)
+        yield missing[j], sections
+    store.flush()
+
+
+def _iter_parse(doc_paths, workers):
+    if workers <= 1 or len(doc_paths) <= 1:
+        return ((i, parse_document(doc_path)) for i, doc_path in enumerate(doc_paths))
+    profiler = profiling.active()
+    if profiler is not None:
+        futures = {get_pool(workers).submit(parse_document_profiled, doc_path): i for i, doc_path in enumerate(doc_paths)}
+        return ((futures[future], _merge_profile(profiler, *future.result())) for future in as_completed(futures))
+    futures = {get_pool(workers).submit(parse_document, doc_path): i for i, doc_path in enumerate(doc_paths)}
+    return ((futures[future], future.result()) for future in as_completed(futures))
+
+
+def _merge_profile(profiler, sections, profile):
+    profiler.merge(profile)
+    return sections
@@ -0,0 +1,342 @@
+"""
+Long-running local ranking service for the 1B ranker.
+
+Keeps the encoder, embedding cache and vector indexes warm between jobs and
+serves them over HTTP on localhost. Encode calls from concurrent jobs are
+coalesced into shared batches: a batch is sent to the model once it holds
+--max-batch texts or its first request has waited --max-wait-ms.
+
+    python src/service.py [--host 127.0.0.1] [--port 8765] [--max-batch 256] [--max-wait-ms 10]
+
+Jobs are sent with the standard-library client in service_client.py.
+
+Endpoints:
+    POST /collection  {"collection_dir": ...}                  rank the folder's challenge1b_input.json
+    POST /query       {"collection_dir": ..., "queries": [...]} rank a batch of persona/job queries
+    GET  /metrics     queue depth, batching and per-stage latency
+    GET  /health
+"""
+import argparse
+import json
+import os
+import signal
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import main as ranker
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BATCH = 256
+DEFAULT_MAX_WAIT_MS = 10
+LATENCY_WINDOW = 1024  # samples kept per stage for percentiles
+
+
+class Metrics:
+    """Thread-safe per-stage latency samples plus named counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._counts = {}
+        self.counters = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+            self._counts[stage] = self._counts.get(stage, 0) + 1
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        with self._lock:
+            stages = {}
+            for stage, samples in self._samples.items():
+                ms = np.array(samples) * 1000
+                stages[stage] = {
+                    "count": self._counts[stage],
+                    "mean_ms": round(float(ms.mean()), 2),
+                    "p50_ms": round(float(np.percentile(ms, 50)), 2),
+                    "p95_ms": round(float(np.percentile(ms, 95)), 2),
+                    "max_ms": round(float(ms.max()), 2),
+                }
+            return {"stages": stages, "counters": dict(self.counters)}
+
+
+class BatchingEncoder:
+    """
+    Wraps an encoder so encode() calls from many threads share model batches.
+    Has the same interface as the encoders in encoders.py, so it can replace ranker.MODEL.
+    """
+
+    def __init__(self, encoder, metrics, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.encoder = encoder
+        self.metrics = metrics
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._worker = threading.Thread(target=self._run, name="encode-batcher", daemon=True)
+        self._worker.start()
+
+    @property
+    def name(self):
+        return self.encoder.name
+
+    @property
+    def fingerprint(self):
+        return self.encoder.fingerprint
+
+    def load(self):
+        return self.encoder.load()
+
+    @property
+    def queue_depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def encode(self, texts, batch_size=None):
+        texts = list(texts)
+        if not texts:
+            return self.encoder.encode(texts)
+        job = {"texts": texts, "enqueued": time.perf_counter(), "done": threading.Event(), "result": None, "error": None}
+        with self._cond:
+            self._pending.append(job)
+            self._cond.notify()
+        job["done"].wait()
+        if job["error"] is not None:
+            raise job["error"]
+        return job["result"]
+
+    def _take_batch(self):
+        """Blocks until a batch is due, then removes and returns its requests."""
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = self._pending[0]["enqueued"] + self.max_wait
+            while sum(len(job["texts"]) for job in self._pending) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, size = [], 0
+            # Always take at least one request, even if it alone exceeds max_batch
+            while self._pending and (not batch or size + len(self._pending[0]["texts"]) <= self.max_batch):
+                job = self._pending.popleft()
+                batch.append(job)
+                size += len(job["texts"])
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            started = time.perf_counter()
+            for job in batch:
+                self.metrics.observe("encode_queue_wait", started - job["enqueued"])
+            texts = [t for job in batch for t in job["texts"]]
+            try:
+                with self.metrics.stage("encode_batch"):
+                    embeddings = self.encoder.encode(texts)
+            except Exception as e:  # hand the failure to every waiting caller
+                for job in batch:
+                    job["error"] = e
+                    job["done"].set()
+                continue
+            self.metrics.increment("encode_batches")
+            self.metrics.increment("encode_requests", len(batch))
+            self.metrics.increment("encoded_texts", len(texts))
+            offset = 0
+            for job in batch:
+                job["result"] = embeddings[offset:offset + len(job["texts"])]
+                offset += len(job["texts"])
+                job["done"].set()
+
+
+class RankingService:
+    """Runs collection and query jobs against the warm encoder, recording per-stage latency."""
+
+    def __init__(self, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.metrics = Metrics()
+        ranker.init_runtime()
+        self.batcher = BatchingEncoder(ranker.MODEL, self.metrics, max_batch, max_wait_ms)
+        ranker.MODEL = self.batcher
+        self.started = time.time()
+        self._active = 0
+        self._active_lock = threading.Lock()
+
+    def warm_up(self):
+        with self.metrics.stage("model_load"):
+            self.batcher.load()
+            ranker.encode(["warm-up"])
+
+    @contextmanager
+    def _job(self, kind):
+        with self._active_lock:
+            self._active += 1
+        try:
+            with self.metrics.stage(f"job_{kind}"):
+                yield
+            self.metrics.increment(f"jobs_{kind}")
+        except Exception:
+            self.metrics.increment("jobs_failed")
+            raise
+        finally:
+            with self._active_lock:
+                self._active -= 1
+            self.flush()
+
+    def flush(self):
+        """Writes the embedding cache metadata, so a killed service never loses what it has encoded."""
+        if ranker.EMBEDDING_CACHE is not None:
+            ranker.EMBEDDING_CACHE.flush()
+
+    def _index(self, collection_dir):
+        pdfs_dir = os.path.join(collection_dir, "PDFs")
+        if not os.path.isdir(pdfs_dir):
+            raise ValueError(f"'PDFs' subfolder not found in '{collection_dir}'")
+        with self.metrics.stage("index"):
+            index = ranker.load_corpus_index(pdfs_dir)
+        if index is None:
+            raise ValueError(f"No text could be extracted from any PDF in '{collection_dir}'")
+        return index
+
+    def _rank(self, index, queries):
+        with self.metrics.stage("rank"):
+            return ranker.rank_queries(index, queries)
+
+    def run_collection(self, collection_dir, write_output=True):
+        """Ranks a collection for its challenge1b_input.json, like the CLI does."""
+        with self._job("collection"):
+            input_json_path = os.path.join(collection_dir, "challenge1b_input.json")
+            if not os.path.exists(input_json_path):
+                raise ValueError(f"'challenge1b_input.json' not found in '{collection_dir}'")
+            with open(input_json_path, 'r') as f:
+                input_data = json.load(f)
+            output = self._rank(self._index(collection_dir), [input_data])[0]
+            output_file = None
+            if write_output:
+                with self.metrics.stage("write"):
+                    output_file = ranker.write_collection_output(collection_dir, [output])
+            return {"output": output, "output_file": output_file}
+
+    def run_queries(self, collection_dir, queries):
+        """Ranks a batch of persona/job queries against a collection's PDFs."""
+        with self._job("query"):
+            if not isinstance(queries, list) or not queries:
+                raise ValueError("'queries' must be a non-empty list of {persona, job_to_be_done} objects")
+            return {"outputs": self._rank(self._index(collection_dir), queries)}
+
+    def metrics_snapshot(self):
+        snapshot = self.metrics.snapshot()
+        snapshot["queue_depth"] = self.batcher.queue_depth
+        snapshot["active_jobs"] = self._active
+        snapshot["uptime_seconds"] = round(time.time() - self.started, 1)
+        if ranker.EMBEDDING_CACHE is not None:
+            snapshot["embedding_cache"] = ranker.EMBEDDING_CACHE.stats()
+        return snapshot
+
+
+def _terminate(signum, frame):
+    # docker stop sends SIGTERM; shut down through the same path as Ctrl+C
+    raise KeyboardInterrupt
+
+
+# --- HTTP ---
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                self._send(200, service.metrics_snapshot())
+            elif self.path == "/health":
+                self._send(200, {"status": "ok", "backend": service.batcher.name})
+            else:
+                self._send(404, {"error": f"unknown path '{self.path}'"})
+
+        def do_POST(self):
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                collection_dir = payload.get("collection_dir")
+                if not collection_dir:
+                    raise ValueError("'collection_dir' is required")
+                if self.path == "/collection":
+                    result = service.run_collection(collection_dir, payload.get("write_output", True))
+                elif self.path == "/query":
+                    result = service.run_queries(collection_dir, payload.get("queries"))
+                else:
+                    self._send(404, {"error": f"unknown path '{self.path}'"})
+                    return
+            except (ValueError, KeyError, TypeError) as e:
+                self._send(400, {"error": str(e)})
+                return
+            except Exception as e:
+                print(f"--> [ERROR] {self.path} failed: {e}")
+                self._send(500, {"error": str(e)})
+                return
+            self._send(200, result)
+
+        def log_message(self, format, *args):
+            pass  # per-request latency is in /metrics
+
+    return Handler
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+    service = RankingService(max_batch, max_wait_ms)
+    service.warm_up()
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    print(f"✅ Ranking service listening on http://{host}:{port} (max batch {max_batch}, max wait {max_wait_ms} ms)")
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.flush()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Warm local ranking service for 1B (send it jobs with service_client.py).")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--backend", choices=["torch", "onnx"], default=ranker.ENCODER_BACKEND)
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH,
+                        help="texts per shared encode batch")
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS,
+                        help="longest a request waits for others to join its batch")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    ranker.init_runtime(args.backend)
+    serve(args.host, args.port, args.max_batch, args.max_wait_ms)
+
+
+if __name__ == "__main__":
+    main()
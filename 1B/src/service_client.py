@@ -0,0 +1,68 @@
+"""
+Command-line client for the local 1B ranking service (service.py).
+
+Uses only the standard library, so it starts instantly and can be used from
+scripts and health checks without loading the ranker.
+
+    python src/service_client.py collection "app/input/Collection 1"
+    python src/service_client.py query "app/input/Collection 1" personas.json
+    python src/service_client.py metrics
+"""
+import argparse
+import json
+import os
+import sys
+from urllib import request as urlrequest
+from urllib.error import HTTPError
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+def call(path, payload=None, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=600):
+    """Sends one request to a running service and returns the decoded JSON response."""
+    data = None if payload is None else json.dumps(payload).encode("utf-8")
+    req = urlrequest.Request(f"http://{host}:{port}{path}", data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urlrequest.urlopen(req, timeout=timeout) as resp:
+            return json.load(resp)
+    except HTTPError as e:
+        raise RuntimeError(f"{path} failed ({e.code}): {json.load(e).get('error')}") from None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Send jobs to a running 1B ranking service.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    sub = parser.add_subparsers(dest="command", required=True)
+    collection_cmd = sub.add_parser("collection", help="rank a collection's challenge1b_input.json")
+    collection_cmd.add_argument("collection_dir")
+    collection_cmd.add_argument("--no-write", action="store_true", help="return the result without writing app/output")
+    query_cmd = sub.add_parser("query", help="rank a JSON list of persona/job queries against a collection")
+    query_cmd.add_argument("collection_dir")
+    query_cmd.add_argument("queries")
+    sub.add_parser("metrics", help="print queue depth, batching and per-stage latency")
+    sub.add_parser("health", help="check that the service is up")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    try:
+        if args.command == "collection":
+            payload = {"collection_dir": os.path.abspath(args.collection_dir), "write_output": not args.no_write}
+            result = call("/collection", payload, args.host, args.port)
+        elif args.command == "query":
+            with open(args.queries, 'r') as f:
+                queries = json.load(f)
+            result = call("/query", {"collection_dir": os.path.abspath(args.collection_dir), "queries": queries}, args.host, args.port)
+        else:
+            result = call(f"/{args.command}", host=args.host, port=args.port)
+    except (RuntimeError, OSError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Bounded-memory ranking support for the 1B ranker.
+
+For collections too large to embed in one go, sections are read a few PDFs at a
+time and handed out in fixed-size chunks in document order. The caller embeds
+and scores each chunk, keeps its best sections in a RunningTopK per query and
+drops the rest, so only the current chunk, the parse window and the running
+top-k (with the full text of those sections) are ever held in memory.
+"""
+import heapq
+
+from parsing import PARSE_WORKERS, iter_parsed_documents
+from vector_index import top_k
+
+
+class RunningTopK:
+    """
+    The k best-scoring sections seen so far. Sections are identified by their
+    position in the corpus, and ties keep the earlier position, as in top_k.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self._heap = []  # min-heap of (score, -position, section): the weakest member is on top
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push_chunk(self, scores, start, sections):
+        """Offers a chunk's scores (-inf = excluded); sections[i] sits at corpus position start + i."""
+        for i in top_k(scores, self.k)[0]:
+            item = (float(scores[i]), -(start + int(i)), sections[i])
+            if len(self._heap) < self.k:
+                heapq.heappush(self._heap, item)
+            elif item[:2] > self._heap[0][:2]:
+                heapq.heapreplace(self._heap, item)
+
+    def best(self):
+        """The kept (position, section) pairs, best first."""
+        ranked = sorted(self._heap, key=lambda item: item[:2], reverse=True)
+        return [(-neg_position, section) for _, neg_position, section in ranked]
+
+
+def iter_section_chunks(doc_paths, chunk_size, store=None, window=None):
+    """
+    Yields (start position, sections) chunks of at most chunk_size sections, in
+    document order. Only `window` PDFs (default: two per parse worker) are parsed
+    ahead, so memory does not grow with the number of PDFs.
+    """
+    window = window or 2 * PARSE_WORKERS
+    buffer, start = [], 0
+    for first in range(0, len(doc_paths), window):
+        # Parsing completes out of order; restore document order so positions match a full index
+        parsed = sorted(iter_parsed_documents(doc_paths[first:first + window], store=store), key=lambda item: item[0])
+        for _, sections in parsed:
+            buffer.extend(sections)
+            while len(buffer) >= chunk_size:
+                yield start, buffer[:chunk_size]
+                buffer, start = buffer[chunk_size:], start + chunk_size
+    if buffer:
+        yield start, buffer
@@ -0,0 +1,136 @@
+"""
+Persistent per-corpus vector index for the 1B ranker.
+
+A corpus (one PDFs/ folder) is parsed and embedded once; the normalized section
+embeddings and the section metadata are then kept on disk so later queries only
+need a matrix product and a top-k selection:
+
+    meta.json     version, model id, dtype and the PDF manifest it was built from
+    content.npy   (sections, dim) normalized section-text embeddings
+    title.npy     (sections, dim) normalized section-title embeddings
+    sections.json document, page_number, section_title and text of every section
+
+The index is rebuilt whenever the model or any PDF (name, size, mtime) changes.
+"""
+import json
+import os
+
+import numpy as np
+
+INDEX_VERSION = 1
+INDEX_DTYPES = ("float32", "float16")
+SCORE_BLOCK_ROWS = 16384  # sections scored per block, so a float16 index is never upcast whole
+
+
+def corpus_manifest(doc_paths):
+    """Identifies the indexed PDFs by name, size and modification time."""
+    manifest = []
+    for path in doc_paths:
+        st = os.stat(path)
+        manifest.append([os.path.basename(path), st.st_size, st.st_mtime_ns])
+    return manifest
+
+
+def normalize_rows(matrix):
+    """Scales each row to unit length, leaving all-zero rows at zero."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def top_k(scores, k):
+    """
+    Returns the indices of the k highest scores in each row, best first.
+    Ties keep index order (like a stable sort) and -inf scores are never returned.
+    """
+    results = []
+    for row in np.atleast_2d(scores):
+        finite = np.isfinite(row)
+        n = min(k, int(finite.sum()))
+        if n == 0:
+            results.append(np.empty(0, dtype=np.int64))
+            continue
+        if n < len(row):
+            # Keep every score tied with the k-th best so the final tie-break sees all of them
+            kth = np.partition(row, len(row) - n)[len(row) - n]
+            candidates = np.flatnonzero(row >= kth)
+        else:
+            candidates = np.flatnonzero(finite)
+        order = np.lexsort((candidates, -row[candidates]))
+        results.append(candidates[order[:n]])
+    return results
+
+
+class VectorIndex:
+    """Normalized content and title embeddings of every section in a corpus, plus their metadata."""
+
+    def __init__(self, sections, documents, content, title, dtype="float32", normalized=False):
+        self.sections = sections
+        self.documents = documents  # PDF file names, in corpus order
+        if normalized:
+            # Stored matrices are used as they are, so a memory-mapped index stays on disk
+            self.content, self.title = content, title
+        else:
+            # float16 halves the memory of the matrices; scores are still accumulated in float32
+            self.content = normalize_rows(content).astype(dtype, copy=False)
+            self.title = normalize_rows(title).astype(dtype, copy=False)
+        doc_ids = {name: i for i, name in enumerate(documents)}
+        self.doc_ids = np.array([doc_ids[sec["document"]] for sec in sections], dtype=np.int64)
+        self._texts_lower = None
+
+    @property
+    def texts_lower(self):
+        """Lower-cased "title text" of every section, for keyword filters (built on first use)."""
+        if self._texts_lower is None:
+            self._texts_lower = [(sec['section_title'] + ' ' + sec['text']).lower() for sec in self.sections]
+        return self._texts_lower
+
+    def __len__(self):
+        return len(self.sections)
+
+    def scores(self, query_embeddings, content_weight, title_weight):
+        """(queries, sections) weighted cosine similarity of every query against every section."""
+        queries = normalize_rows(query_embeddings)
+        scores = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), SCORE_BLOCK_ROWS):
+            stop = start + SCORE_BLOCK_ROWS
+            content = np.asarray(self.content[start:stop], dtype=np.float32)
+            title = np.asarray(self.title[start:stop], dtype=np.float32)
+            scores[:, start:stop] = content_weight * (queries @ content.T) + title_weight * (queries @ title.T)
+        return scores
+
+    # --- Storage ---
+    def save(self, index_dir, model_id, manifest, dtype="float32"):
+        """Writes the index atomically enough that a crash leaves either the old index or none."""
+        os.makedirs(index_dir, exist_ok=True)
+        meta_path = os.path.join(index_dir, "meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)  # the index is only valid once meta.json is written last
+        np.save(os.path.join(index_dir, "content.npy"), self.content.astype(dtype))
+        np.save(os.path.join(index_dir, "title.npy"), self.title.astype(dtype))
+        with open(os.path.join(index_dir, "sections.json"), "w", encoding="utf-8") as f:
+            json.dump({"documents": self.documents, "sections": self.sections}, f, ensure_ascii=False)
+        meta = {"version": INDEX_VERSION, "model_id": model_id, "dtype": dtype, "sections": len(self), "manifest": manifest}
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    @classmethod
+    def load(cls, index_dir, model_id, manifest):
+        """Returns the stored index, or None if it is missing or was built from another model or corpus."""
+        try:
+            with open(os.path.join(index_dir, "meta.json")) as f:
+                meta = json.load(f)
+            if meta.get("version") != INDEX_VERSION or meta.get("model_id") != model_id or meta.get("manifest") != manifest:
+                return None
+            with open(os.path.join(index_dir, "sections.json"), encoding="utf-8") as f:
+                stored = json.load(f)
+            content = np.load(os.path.join(index_dir, "content.npy"), mmap_mode="r")
+            title = np.load(os.path.join(index_dir, "title.npy"), mmap_mode="r")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"--> [Warning] Vector index at '{index_dir}' is unreadable, rebuilding. Error: {e}")
+            return None
+        if len(content) != len(stored["sections"]) or content.dtype != np.dtype(meta.get("dtype")):
+            return None
+        return cls(stored["sections"], stored["documents"], content, title, meta["dtype"], normalized=True)
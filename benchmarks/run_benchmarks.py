@@ -0,0 +1,392 @@
+"""
+Benchmark and regression suite for the 1A outline extractor and the 1B ranker.
+
+Generates synthetic PDFs of controlled size, measures pages/sec, peak memory and
+per-stage time, checks the readme performance claims, and diffs the output of
+the sample inputs against the checked-in golden JSON files so speedups can be
+shown not to change results.
+
+Usage:
+    python benchmarks/run_benchmarks.py                  # 1A + 1B, benchmarks + golden checks
+    python benchmarks/run_benchmarks.py --suite 1a --pages 50 500
+    python benchmarks/run_benchmarks.py --golden-only --results bench.json
+
+The exit code is non-zero when a golden file differs, a readme claim fails or a
+requested app cannot be imported.
+Golden files were produced with the pinned PyMuPDF==1.24.7; other versions can
+extract slightly different text and show up as diffs.
+"""
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import fitz  # PyMuPDF
+
+import synthetic_pdfs
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_1A = os.path.join(REPO_ROOT, "1A")
+APP_1B = os.path.join(REPO_ROOT, "1B")
+
+# Performance claims made in the readmes
+CLAIM_1A_PAGES, CLAIM_1A_SECONDS = 50, 10.0
+CLAIM_1B_DOCS, CLAIM_1B_SECONDS = 5, 60.0
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# --- Measurement helpers ---
+def current_rss_mb():
+    """Resident set size of this process, from /proc when available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        if resource is not None:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return 0.0
+
+
+class PeakMemory:
+    """Samples RSS on a background thread and records the peak seen inside the block."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start_mb = self.peak_mb = 0.0
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = current_rss_mb()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    @property
+    def delta_mb(self):
+        return round(self.peak_mb - self.start_mb, 1)
+
+
+class StageTimer:
+    """Accumulates wall time per named stage."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def __call__(self, name):
+        timer = self
+
+        class _Stage:
+            def __enter__(self):
+                self.start = time.perf_counter()
+
+            def __exit__(self, *exc):
+                timer.stages[name] = timer.stages.get(name, 0.0) + time.perf_counter() - self.start
+
+        return _Stage()
+
+    def rounded(self):
+        return {name: round(seconds, 4) for name, seconds in self.stages.items()}
+
+
+def load_module(name, path):
+    """
+    Imports a script by path; both apps call their entry point main.py. The script's
+    directory goes on sys.path first, since both import sibling modules (profiling, ...).
+    """
+    script_dir = os.path.dirname(os.path.abspath(path))
+    if script_dir not in sys.path:
+        sys.path.insert(0, script_dir)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_1b(errors):
+    """
+    Imports 1B/src/main.py from the 1B directory, where its model path resolves, with its
+    embedding cache, parse store and vector index turned off. Returns None and records
+    the error if it cannot be imported.
+    """
+    cwd = os.getcwd()
+    os.chdir(APP_1B)
+    try:
+        ranker = load_module("ranker_main", os.path.join(APP_1B, "src", "main.py"))
+        # No persistent caches: every run parses and encodes, and 1B/cache is left untouched
+        ranker.EMBEDDING_CACHE_DIR = ranker.PARSE_CACHE_DIR = ranker.VECTOR_INDEX_DIR = ""
+        ranker.init_runtime()
+        return ranker
+    except Exception as e:
+        print(f"--> [ERROR] Could not import 1B/src/main.py ({type(e).__name__}: {e})")
+        errors.append(f"1B import failed: {type(e).__name__}: {e}")
+        return None
+    finally:
+        os.chdir(cwd)
+
+
+# --- 1A ---
+def run_outline_stages(outline, pdf_path, timer):
+    """Runs the extract_outline pipeline stage by stage, timing each one."""
+    with timer("open"):
+        doc = fitz.open(pdf_path)
+    with timer("text_extraction"):
+        layout = outline.extract_layout(doc)
+    with timer("language_detection"):
+        lang = outline.detect_language(layout)
+    if doc.page_count == 1:
+        with timer("heading_classification"):
+            result = outline.extract_from_flyer(layout, lang)
+        doc.close()
+        return result
+    with timer("body_size_histogram"):
+        title = outline.get_document_title(doc)
+        font_sizes = Counter(round(span["size"]) for blocks in layout for span in outline.iter_spans(blocks))
+        body_size = font_sizes.most_common(1)[0][0] if font_sizes else 12
+    doc.close()
+    with timer("heading_classification"):
+        found, entries = set(), []
+        for page_num, blocks in enumerate(layout):
+            entries.extend(outline.classify_page_headings(blocks, page_num, body_size, lang, found))
+    return {"title": title, "outline": entries}
+
+
+def bench_1a(outline, workdir, page_counts, headings_per_page, repeat):
+    cases = []
+    specs = [("flyer", "latin", 1)]
+    for pages in page_counts:
+        specs.append(("document", "latin", pages))
+        specs.append(("document", "cjk", pages))
+    for layout, script, pages in specs:
+        name = f"1a-{layout}-{script}-{pages}p"
+        path = os.path.join(workdir, f"{name}.pdf")
+        if layout == "flyer":
+            synthetic_pdfs.make_flyer(path, script=script)
+        else:
+            synthetic_pdfs.make_document(path, pages=pages, headings_per_page=headings_per_page, script=script)
+
+        best, stages, headings = None, None, 0
+        for _ in range(repeat):
+            timer = StageTimer()
+            with PeakMemory() as mem:
+                start = time.perf_counter()
+                staged = run_outline_stages(outline, path, timer)
+                elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best, stages, peak = elapsed, timer.rounded(), mem.delta_mb
+            headings = len(staged["outline"])
+
+        # The staged run must agree with the real entry point
+        consistent = outline.extract_outline(path) == staged
+        cases.append({
+            "case": name, "pages": pages, "headings": headings, "seconds": round(best, 4),
+            "pages_per_sec": round(pages / best, 1) if best else None,
+            "peak_rss_delta_mb": peak, "stages": stages, "consistent": consistent,
+        })
+    return cases
+
+
+def golden_1a(outline):
+    diffs = []
+    for golden_path in sorted(glob.glob(os.path.join(APP_1A, "output", "*.json"))):
+        name = os.path.splitext(os.path.basename(golden_path))[0]
+        pdf_path = os.path.join(APP_1A, "input", f"{name}.pdf")
+        if not os.path.exists(pdf_path):
+            continue
+        with open(golden_path, encoding="utf-8") as f:
+            expected = json.load(f)
+        actual = outline.extract_outline(pdf_path)
+        diffs.append({"file": f"1A/output/{name}.json", "match": actual == expected, "diff": describe_diff(expected, actual)})
+    return diffs
+
+
+# --- 1B ---
+def bench_1b(ranker, workdir, documents, pages, repeat):
+    collection_dir = os.path.join(workdir, "collection")
+    synthetic_pdfs.make_collection(os.path.join(collection_dir, "PDFs"), documents=documents, pages=pages)
+    query = {"persona": {"role": "Travel Planner"}, "job_to_be_done": {"task": "Plan a trip of 4 days for a group of 10 college friends."}}
+    with open(os.path.join(collection_dir, "challenge1b_input.json"), "w", encoding="utf-8") as f:
+        json.dump(query, f)
+    # Same order as process_collection, so the staged output can be compared with it
+    paths = ranker.list_pdfs(os.path.join(collection_dir, "PDFs"))
+
+    best = None
+    for _ in range(repeat):
+        timer = StageTimer()
+        with PeakMemory() as mem:
+            start = time.perf_counter()
+            with timer("embed_documents"):
+                embedded = ranker.embed_documents(paths)
+            with timer("assemble_index"):
+                index = ranker.assemble_index(paths, embedded)
+            with timer("rank_queries"):
+                staged = ranker.rank_queries(index, [query])[0]
+            elapsed = time.perf_counter() - start
+        if best is None or elapsed < best["seconds"]:
+            best = {"seconds": round(elapsed, 4), "stages": timer.rounded(), "peak_rss_delta_mb": mem.delta_mb}
+
+    # The staged run must agree with the real entry point
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with open(ranker.process_collection(collection_dir), encoding="utf-8") as f:
+            actual = json.load(f)
+    finally:
+        os.chdir(cwd)
+    staged = json.loads(json.dumps(staged))
+    for data in (staged, actual):
+        data["metadata"].pop("processing_timestamp", None)
+
+    total_pages = documents * pages
+    return [{
+        "case": f"1b-collection-{documents}x{pages}p", "pages": total_pages, "sections": len(index),
+        "pages_per_sec": round(total_pages / best["seconds"], 1) if best["seconds"] else None, **best,
+        "consistent": staged == actual,
+    }]
+
+
+def golden_1b(ranker):
+    diffs = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        # process_collection writes to ./app/output/<collection>, so run it from a scratch directory
+        os.chdir(tmp)
+        try:
+            for collection_dir in sorted(glob.glob(os.path.join(APP_1B, "app", "input", "*"))):
+                name = os.path.basename(collection_dir)
+                golden_path = os.path.join(APP_1B, "app", "output", name, "challenge1b_output.json")
+                if not os.path.exists(golden_path):
+                    continue
+                ranker.process_collection(collection_dir)
+                with open(golden_path, encoding="utf-8") as f:
+                    expected = json.load(f)
+                with open(os.path.join(tmp, "app", "output", name, "challenge1b_output.json"), encoding="utf-8") as f:
+                    actual = json.load(f)
+                for data in (expected, actual):
+                    data["metadata"].pop("processing_timestamp", None)
+                diffs.append({"file": f"1B/app/output/{name}/challenge1b_output.json", "match": actual == expected,
+                              "diff": describe_diff(expected, actual)})
+        finally:
+            os.chdir(cwd)
+    return diffs
+
+
+def describe_diff(expected, actual, path="$"):
+    """Returns a short description of the first difference between two JSON values, or None."""
+    if type(expected) is not type(actual):
+        return f"{path}: expected {type(expected).__name__}, got {type(actual).__name__}"
+    if isinstance(expected, dict):
+        for key in expected.keys() | actual.keys():
+            if key not in actual:
+                return f"{path}.{key}: missing"
+            if key not in expected:
+                return f"{path}.{key}: unexpected"
+            found = describe_diff(expected[key], actual[key], f"{path}.{key}")
+            if found:
+                return found
+        return None
+    if isinstance(expected, list):
+        for i, (e, a) in enumerate(zip(expected, actual)):
+            found = describe_diff(e, a, f"{path}[{i}]")
+            if found:
+                return found
+        if len(expected) != len(actual):
+            return f"{path}: expected {len(expected)} items, got {len(actual)}"
+        return None
+    if expected != actual:
+        return f"{path}: expected {expected!r}, got {actual!r}"
+    return None
+
+
+# --- Reporting ---
+def print_cases(cases):
+    print(f"\n{'case':<34}{'pages':>7}{'sec':>10}{'pages/s':>10}{'peak MB':>10}  stages")
+    for c in cases:
+        stages = ", ".join(f"{k}={v:.3f}" for k, v in c["stages"].items())
+        print(f"{c['case']:<34}{c['pages']:>7}{c['seconds']:>10.3f}{c['pages_per_sec'] or 0:>10.1f}{c['peak_rss_delta_mb']:>10.1f}  {stages}")
+
+
+def print_golden(diffs):
+    print()
+    for d in diffs:
+        print(f"{'✅' if d['match'] else '❌'} {d['file']}" + ("" if d["match"] else f"  ({d['diff']})"))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark and regression suite for 1A and 1B.")
+    parser.add_argument("--suite", choices=["1a", "1b", "all"], default="all")
+    parser.add_argument("--pages", type=int, nargs="+", default=[CLAIM_1A_PAGES, 300], help="1A document sizes to generate")
+    parser.add_argument("--headings-per-page", type=int, default=3)
+    parser.add_argument("--documents", type=int, default=CLAIM_1B_DOCS, help="PDFs in the synthetic 1B collection")
+    parser.add_argument("--doc-pages", type=int, default=10, help="pages per synthetic 1B PDF")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the fastest is reported")
+    parser.add_argument("--golden-only", action="store_true", help="only diff against the checked-in outputs")
+    parser.add_argument("--no-golden", action="store_true", help="skip the golden-file comparison")
+    parser.add_argument("--results", default=None, help="write all results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {"pymupdf": fitz.VersionBind, "cases": [], "golden": [], "claims": [], "errors": []}
+
+    outline = load_module("outline_main", os.path.join(APP_1A, "app", "main.py")) if args.suite in ("1a", "all") else None
+    ranker = load_1b(results["errors"]) if args.suite in ("1b", "all") else None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if not args.golden_only:
+            if outline:
+                cases = bench_1a(outline, workdir, args.pages, args.headings_per_page, args.repeat)
+                results["cases"].extend(cases)
+                for c in cases:
+                    if c["pages"] == CLAIM_1A_PAGES:
+                        results["claims"].append({"claim": f"1A: {CLAIM_1A_PAGES}-page PDF within {CLAIM_1A_SECONDS:.0f}s",
+                                                  "case": c["case"], "seconds": c["seconds"], "ok": c["seconds"] <= CLAIM_1A_SECONDS})
+            if ranker:
+                cases = bench_1b(ranker, workdir, args.documents, args.doc_pages, args.repeat)
+                results["cases"].extend(cases)
+                results["claims"].append({"claim": f"1B: {args.documents} PDFs in under {CLAIM_1B_SECONDS:.0f}s",
+                                          "case": cases[0]["case"], "seconds": cases[0]["seconds"], "ok": cases[0]["seconds"] < CLAIM_1B_SECONDS})
+        if not args.no_golden:
+            if outline:
+                results["golden"].extend(golden_1a(outline))
+            if ranker:
+                results["golden"].extend(golden_1b(ranker))
+
+    if results["cases"]:
+        print_cases(results["cases"])
+    for claim in results["claims"]:
+        print(f"{'✅' if claim['ok'] else '❌'} {claim['claim']}: {claim['seconds']:.2f}s")
+    if results["golden"]:
+        print_golden(results["golden"])
+    if args.results:
+        with open(args.results, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nResults saved to {args.results}")
+
+    failed = [g for g in results["golden"] if not g["match"]] + [c for c in results["claims"] if not c["ok"]]
+    failed += [c for c in results["cases"] if c.get("consistent") is False] + results["errors"]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Synthetic PDF generator for the 1A/1B benchmarks.
+
+Builds documents of a controlled size with PyMuPDF so page count, headings per
+page, script (Latin or CJK) and layout (multi-page document or single-page
+flyer) can be varied independently. Output is deterministic for a given seed.
+"""
+import os
+import random
+
+import fitz  # PyMuPDF
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 56
+HEADING_SIZE, SUBHEADING_SIZE, BODY_SIZE = 18, 14, 10
+
+LATIN_WORDS = (
+    "travel budget planning coastal city museum harbour market recipe dinner "
+    "vegetable garden form signature export document share review season "
+    "evening festival history culture restaurant hotel beach train schedule "
+    "ingredient oven minutes serve fresh local guide visitor weekend family"
+).split()
+LATIN_TITLES = ["Introduction", "Overview", "Background", "Planning", "Methods", "Results",
+                "Recommendations", "Appendix", "Getting Started", "Useful Tips"]
+CJK_CHARS = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经"
+CJK_TITLES = ["概要", "背景", "方法", "结果", "建议", "附录", "计划", "总结"]
+
+
+def _latin_sentence(rng, words=12):
+    text = " ".join(rng.choice(LATIN_WORDS) for _ in range(words))
+    return text.capitalize() + "."
+
+
+def _cjk_sentence(rng, chars=24):
+    return "".join(rng.choice(CJK_CHARS) for _ in range(chars)) + "。"
+
+
+def make_document(path, pages=10, headings_per_page=2, script="latin", lines_per_section=6, seed=0):
+    """
+    Writes a multi-page document with numbered H1/H2 headings followed by body text.
+    The first heading on each page is a chapter (H1); the rest are sections (H2).
+    """
+    rng = random.Random(seed)
+    cjk = script == "cjk"
+    body_font = "china-s" if cjk else "helv"
+    heading_font = "china-s" if cjk else "hebo"
+    sentence = _cjk_sentence if cjk else _latin_sentence
+
+    doc = fitz.open()
+    doc.set_metadata({"title": f"Synthetic {script} document ({pages} pages)"})
+    for page_num in range(pages):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        y = MARGIN + HEADING_SIZE
+        for h in range(headings_per_page):
+            if h == 0:
+                if cjk:
+                    text = f"第{page_num + 1}章 {rng.choice(CJK_TITLES)}"
+                else:
+                    text = f"{page_num + 1}. {rng.choice(LATIN_TITLES)}"
+                size = HEADING_SIZE
+            else:
+                text = f"{page_num + 1}.{h} {rng.choice(CJK_TITLES if cjk else LATIN_TITLES)}"
+                size = SUBHEADING_SIZE
+            page.insert_text((MARGIN, y), text, fontsize=size, fontname=heading_font)
+            y += size * 1.8
+            for _ in range(lines_per_section):
+                if y > PAGE_HEIGHT - MARGIN:
+                    break
+                page.insert_text((MARGIN, y), sentence(rng), fontsize=BODY_SIZE, fontname=body_font)
+                y += BODY_SIZE * 1.6
+            y += BODY_SIZE
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def make_flyer(path, script="latin", seed=0):
+    """Writes a single-page flyer: one oversized hero line plus scattered smaller text."""
+    rng = random.Random(seed)
+    cjk = script == "cjk"
+    font = "china-s" if cjk else "hebo"
+    doc = fitz.open()
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    hero = "夏日派对邀请" if cjk else "YOU'RE INVITED TO A PARTY"
+    page.insert_text((MARGIN, 200), hero, fontsize=36, fontname=font)
+    y = 280
+    for _ in range(8):
+        text = _cjk_sentence(rng, 10) if cjk else " ".join(rng.choice(LATIN_WORDS) for _ in range(5)).upper()
+        page.insert_text((MARGIN + rng.randint(0, 120), y), text, fontsize=rng.choice([12, 14, 16]), fontname=font)
+        y += 48
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def make_collection(directory, documents=5, pages=8, headings_per_page=3, seed=0):
+    """Writes a 1B-style PDFs/ folder of Latin documents and returns their paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(documents):
+        path = os.path.join(directory, f"Synthetic Guide - Part {i + 1}.pdf")
+        paths.append(make_document(path, pages=pages, headings_per_page=headings_per_page, seed=seed + i))
+    return paths